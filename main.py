@@ -5,10 +5,16 @@ from PIL import Image
 import pandas as pd
 import plotly.express as px
 import gspread
+from gspread.utils import a1_to_rowcol, numericise_all, rowcol_to_a1, to_records
 from oauth2client.service_account import ServiceAccountCredentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseUpload
 from googleapiclient.http import MediaFileUpload
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from googleapiclient.http import HttpRequest
+from googleapiclient.errors import HttpError
+import httplib2
 import io
 from fpdf import FPDF
 import datetime
@@ -18,6 +24,21 @@ from datetime import datetime, date
 import threading
 import time
 import json
+from cachetools import LRUCache
+import contextlib
+import glob
+import hashlib
+import unicodedata
+import uuid
+import csv
+import zipfile
+from fontTools import subset
+from fontTools.ttLib import TTFont
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlite3
+import requests
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_exponential
 
 
 ## Configuração da página ##
@@ -50,131 +71,619 @@ else:
         scopes=scopes
     )
 
-drive_service = build('drive', 'v3', credentials=creds)
+## Clientes Google ##
+# Criados só quando alguma página precisa deles e compartilhados por todas as sessões
+@st.cache_resource
+def obter_drive_service():
+    """Serviço do Drive do processo; cada thread usa sua própria conexão HTTP"""
+    conexoes = threading.local()
+
+    def criar_requisicao(http, *args, **kwargs):
+        # httplib2 não é thread-safe, então cada thread ganha sua conexão autorizada
+        if not hasattr(conexoes, "http"):
+            conexoes.http = creds.authorize(httplib2.Http())
+        return HttpRequest(conexoes.http, *args, **kwargs)
+
+    return build('drive', 'v3', credentials=creds, requestBuilder=criar_requisicao)
+
+@st.cache_resource
+def obter_planilha():
+    """Abre a planilha Plastcor_Estampas uma única vez por processo"""
+    client = gspread.authorize(creds) #Acessando sheets
+
+    return client.open(
+        title="Plastcor_Estampas", 
+        folder_id="1CEp2KbtqQnOx3beI2aseUxjPZ1AWe8J6"
+        )
+
+# Posição de cada aba dentro da planilha
+INDICE_ABAS = {
+    "Producao": 0,
+    "Quadro": 1,
+    "Falta": 2,
+    "OS": 3,
+}
+
+@st.cache_resource
+def obter_aba(nome_aba):
+    """Obtém (uma vez por processo) a aba da planilha com o nome lógico informado"""
+    return obter_planilha().get_worksheet(INDICE_ABAS[nome_aba]) #Obtendo planilha Real
+
+## Catálogo da pasta de estampas ##
+# Tempo (em segundos) entre duas consultas ao feed de mudanças do Drive
+TTL_CATALOGO = int(st.secrets.get("ttl_catalogo", 300))
+
+# Máscara mínima de campos pedida ao Drive para cada estampa
+CAMPOS_ARQUIVO = "id, name, mimeType, md5Checksum, size, modifiedTime"
+
+@st.cache_resource
+def catalogo_estampas(pasta_id):
+    """Catálogo de uma pasta do Drive compartilhado entre as sessões"""
+    return {
+        "lock": threading.Lock(),
+        "arquivos": None,      # id → metadados
+        "token": None,         # posição no feed de mudanças do Drive
+        "atualizado_em": 0.0,
+    }
+
+def _listar_pasta_completa(pasta_id):
+    """Percorre todas as páginas da listagem de imagens de uma pasta"""
+    arquivos = {}
+    page_token = None
+
+    while True:
+        results = obter_drive_service().files().list(
+            q=f"'{pasta_id}' in parents and mimeType contains 'image/' and trashed = false",
+            fields=f"nextPageToken, files({CAMPOS_ARQUIVO})",
+            pageSize=1000,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ).execute()
+
+        for arquivo in results.get('files', []):
+            arquivos[arquivo['id']] = arquivo
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return arquivos
+
+def _aplicar_mudancas(catalogo, pasta_id):
+    """Atualiza o catálogo só com o que mudou no Drive desde a última consulta"""
+    page_token = catalogo["token"]
+
+    while True:
+        results = obter_drive_service().changes().list(
+            pageToken=page_token,
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file(parents, trashed, {CAMPOS_ARQUIVO}))",
+            pageSize=1000,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ).execute()
+
+        for mudanca in results.get('changes', []):
+            arquivo = mudanca.get('file') or {}
+            continua_na_pasta = (
+                not mudanca.get('removed')
+                and not arquivo.get('trashed')
+                and pasta_id in arquivo.get('parents', [])
+                and arquivo.get('mimeType', '').startswith('image/')
+            )
+
+            if continua_na_pasta:
+                catalogo["arquivos"][mudanca['fileId']] = {
+                    campo: arquivo[campo] for campo in CAMPOS_ARQUIVO.split(", ") if campo in arquivo
+                }
+            else:
+                catalogo["arquivos"].pop(mudanca['fileId'], None)
+
+        if 'newStartPageToken' in results:
+            catalogo["token"] = results['newStartPageToken']
+            return
+
+        page_token = results['nextPageToken']
 
 def listar_imagens_na_pasta(pasta_id):
     """Lista todas as imagens em uma pasta do Drive"""
-    try:
-        print(f"Buscando na pasta ID: {pasta_id}")  # Debug
-        
-        query = f"'{pasta_id}' in parents and mimeType contains 'image/'"
-        results = drive_service.files().list(
-            q=query,
-            fields="files(id, name, mimeType)"
-        ).execute()
-        
-        files = results.get('files', [])
-        print(f"Encontrados {len(files)} arquivos")  # Debug
-        
-        return files
-        
-    except Exception as e:
-        st.error(f"Erro ao acessar a pasta: {e}")
-        return []
+    catalogo = catalogo_estampas(pasta_id)
+
+    with catalogo["lock"]:
+        try:
+            if catalogo["arquivos"] is None or catalogo["token"] is None:
+                print(f"Buscando na pasta ID: {pasta_id}")  # Debug
+
+                # O token é pego antes da listagem para não perder mudanças feitas durante ela
+                token = obter_drive_service().changes().getStartPageToken(supportsAllDrives=True).execute()
+                catalogo["arquivos"] = _listar_pasta_completa(pasta_id)
+                catalogo["token"] = token['startPageToken']
+                catalogo["atualizado_em"] = time.time()
+
+                print(f"Encontrados {len(catalogo['arquivos'])} arquivos")  # Debug
+
+            elif time.time() - catalogo["atualizado_em"] > TTL_CATALOGO:
+                _aplicar_mudancas(catalogo, pasta_id)
+                catalogo["atualizado_em"] = time.time()
+
+        except Exception as e:
+            # A próxima consulta refaz a listagem completa
+            catalogo["token"] = None
+            if catalogo["arquivos"] is None:
+                st.error(f"Erro ao acessar a pasta: {e}")
+                return []
+
+        return sorted(catalogo["arquivos"].values(), key=lambda arquivo: arquivo['name'])
+
+def indexar_imagens(arquivos):
+    """Monta o índice nome → metadados (id, mimeType, md5Checksum, size) a partir da listagem"""
+    indice = {}
+    for arquivo in arquivos:
+        indice.setdefault(arquivo['name'].rsplit('.', 1)[0], arquivo)
+    # O nome completo (com extensão) sempre tem prioridade sobre o nome sem extensão
+    for arquivo in arquivos:
+        indice[arquivo['name']] = arquivo
+    return indice
+
+## Cache local das imagens ##
+# Pasta onde as estampas baixadas ficam guardadas entre execuções e reinícios
+PASTA_CACHE = st.secrets.get("pasta_cache", ".cache")
+PASTA_CACHE_IMAGENS = os.path.join(PASTA_CACHE, "estampas")
+PASTA_RENDICOES = os.path.join(PASTA_CACHE, "rendicoes")
+
+# Versões reduzidas geradas a partir de cada estampa
+RENDICOES = {
+    # Prévia leve para o navegador (st.image)
+    "previa": {"tamanho": (600, 600), "formato": "WEBP", "extensao": "webp", "qualidade": 80},
+    # Quadro da OS: 50 mm a 300 dpi de largura (≈591 px) e 75 mm de altura (≈886 px)
+    "pdf": {"tamanho": (591, 886), "formato": "JPEG", "extensao": "jpg", "qualidade": 85},
+}
+
+# Quantas imagens são baixadas do Drive ao mesmo tempo (cada uma com sua própria conexão)
+DOWNLOADS_PARALELOS = int(st.secrets.get("downloads_paralelos", 4))
+
+def _versao_segura(md5, modificado):
+    """Identificador da versão de um arquivo do Drive que pode ir no nome de um arquivo local"""
+    return "".join(c for c in (md5 or modificado or "") if c.isalnum())
+
+def _baixar_bytes_drive(file_id):
+    """Baixa o conteúdo bruto de um arquivo do Drive"""
+    request = obter_drive_service().files().get_media(fileId=file_id)
+    fh = io.BytesIO()
+    downloader = MediaIoBaseDownload(fh, request)
+
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+
+    return fh.getvalue()
+
+def _gravar_arquivo_cache(caminho, conteudo, padrao_antigos):
+    """Grava um arquivo do cache de forma atômica e apaga as versões antigas dele"""
+    pasta = os.path.dirname(caminho)
+    os.makedirs(pasta, exist_ok=True)
+    for antigo in glob.glob(os.path.join(pasta, padrao_antigos)):
+        if antigo != caminho:
+            os.unlink(antigo)
+
+    with tempfile.NamedTemporaryFile(dir=pasta, delete=False) as temp_file:
+        temp_file.write(conteudo)
+    os.replace(temp_file.name, caminho)
+
+@st.cache_data(max_entries=50, show_spinner=False)
+def obter_bytes_imagem(file_id, md5, modificado):
+    """Devolve o conteúdo de uma imagem, indo ao Drive no máximo uma vez por versão do arquivo"""
+    caminho = os.path.join(PASTA_CACHE_IMAGENS, f"{file_id}_{_versao_segura(md5, modificado)}")
+
+    if os.path.exists(caminho):
+        with open(caminho, 'rb') as f:
+            conteudo = f.read()
+        # Arquivo local corrompido é descartado e baixado de novo
+        if not md5 or hashlib.md5(conteudo).hexdigest() == md5:
+            return conteudo
+
+    conteudo = _baixar_bytes_drive(file_id)
+    if md5 and hashlib.md5(conteudo).hexdigest() != md5:
+        raise IOError(f"Checksum do arquivo {file_id} não confere com o Drive")
 
-imagens = listar_imagens_na_pasta(st.secrets["id_imagens"])
+    try:
+        _gravar_arquivo_cache(caminho, conteudo, f"{file_id}_*")
+    except OSError as e:
+        # Sem disco gravável seguimos só com o cache em memória
+        print(f"Não foi possível gravar {caminho}: {e}")  # Debug
+
+    return conteudo
+
+def gerar_rendicao(conteudo, tipo):
+    """Reduz uma imagem para o tamanho e formato de uma das RENDICOES"""
+    config = RENDICOES[tipo]
+    imagem = Image.open(io.BytesIO(conteudo))
+    imagem.thumbnail(config["tamanho"], Image.LANCZOS)
+
+    if config["formato"] == "JPEG":
+        if imagem.mode in ('RGBA', 'LA', 'P'):
+            # Se tem transparência, converter para RGB com fundo branco
+            imagem = imagem.convert('RGBA')
+            background = Image.new('RGB', imagem.size, (255, 255, 255))
+            background.paste(imagem, mask=imagem.split()[-1])
+            imagem = background
+        elif imagem.mode != 'RGB':
+            imagem = imagem.convert('RGB')
+
+    saida = io.BytesIO()
+    imagem.save(saida, format=config["formato"], quality=config["qualidade"])
+    return saida.getvalue()
+
+@st.cache_data(max_entries=200, show_spinner=False)
+def obter_rendicao(file_id, md5, modificado, tipo):
+    """Devolve uma versão reduzida da imagem, gerada uma única vez por versão do arquivo"""
+    config = RENDICOES[tipo]
+    caminho = os.path.join(
+        PASTA_RENDICOES,
+        f"{file_id}_{_versao_segura(md5, modificado)}_{tipo}.{config['extensao']}"
+    )
 
-nomes_sem_extensao = [imagem['name'].rsplit('.', 1)[0] for imagem in imagens]
+    if os.path.exists(caminho):
+        with open(caminho, 'rb') as f:
+            return f.read()
 
-nomes_com_extensao = [imagem['name'] for imagem in imagens]
+    conteudo = gerar_rendicao(obter_bytes_imagem(file_id, md5, modificado), tipo)
 
-nomes_com_b = [imagem['name'].rsplit('.', 1)[0] for imagem in imagens if imagem['name'].startswith('b_')]
+    try:
+        _gravar_arquivo_cache(caminho, conteudo, f"{file_id}_*_{tipo}.*")
+    except OSError as e:
+        print(f"Não foi possível gravar {caminho}: {e}")  # Debug
+
+    return conteudo
+
+@st.cache_resource
+def pregerar_rendicoes(_arquivos):
+    """Gera em segundo plano, uma vez por processo, as versões reduzidas de todas as estampas"""
+    arquivos = list(_arquivos)
+
+    def trabalhar():
+        for arquivo in arquivos:
+            for tipo in RENDICOES:
+                try:
+                    obter_rendicao(arquivo['id'], arquivo.get('md5Checksum'),
+                                   arquivo.get('modifiedTime'), tipo)
+                except Exception as e:
+                    print(f"Falha ao gerar '{tipo}' de {arquivo['name']}: {e}")  # Debug
+
+    thread = threading.Thread(target=trabalhar, daemon=True)
+    thread.start()
+    return thread
+
+def localizar_imagem(nome_imagem, pasta_id):
+    """Busca os metadados de uma imagem pelo nome exato, com ou sem extensão"""
+    file_info = indice_estampas.get(nome_imagem)
+    if file_info:
+        return file_info
+
+    # Arquivo criado depois da listagem da pasta: consulta pelo nome exato
+    nome_escapado = nome_imagem.replace("\\", "\\\\").replace("'", "\\'")
+    query = f"'{pasta_id}' in parents and name = '{nome_escapado}' and mimeType contains 'image/'"
+    results = obter_drive_service().files().list(
+        q=query,
+        fields="files(id, name, mimeType, md5Checksum, size, modifiedTime)"
+    ).execute()
+
+    files = results.get('files', [])
+
+    if not files:
+        st.error(f"Imagem '{nome_imagem}' não encontrada na pasta")
+        return None
 
-mapeamento_estampas = dict(zip(nomes_sem_extensao, nomes_com_extensao))
+    return files[0]
 
-def baixar_imagem_por_nome(nome_imagem, pasta_id):
-    """Baixa uma imagem específica pelo nome da pasta do Drive"""
+def baixar_rendicao_por_nome(nome_imagem, pasta_id, tipo="previa"):
+    """Devolve os bytes da versão reduzida de uma imagem da pasta do Drive"""
     try:
-        query = f"'{pasta_id}' in parents and name contains '{nome_imagem}' and mimeType contains 'image/'"
-        results = drive_service.files().list(
-            q=query,
-            fields="files(id, name)"
-        ).execute()
-        
-        files = results.get('files', [])
-        
-        if not files:
-            st.error(f"Imagem '{nome_imagem}' não encontrada na pasta")
+        file_info = localizar_imagem(nome_imagem, pasta_id)
+        if not file_info:
             return None
-        
-        # Pegar o primeiro resultado (deve ser único)
-        file_info = files[0]
-        
-        # Fazer o download
-        request = drive_service.files().get_media(fileId=file_info['id'])
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        
-        fh.seek(0)
-        return Image.open(fh)
-        
+
+        return obter_rendicao(
+            file_info['id'],
+            file_info.get('md5Checksum'),
+            file_info.get('modifiedTime'),
+            tipo
+        )
+
     except Exception as e:
         st.error(f"Erro ao baixar imagem '{nome_imagem}': {e}")
         return None
     
-def adicionar_imagem_ao_pdf(nome_imagem, pasta_id, pdf, x, y, largura):
-    """Adiciona imagem baixada do Drive diretamente ao PDF"""
+def baixar_rendicoes(nomes, pasta_id, tipo="previa"):
+    """Baixa em paralelo as versões reduzidas de várias imagens, uma vez por arquivo (nome -> bytes)"""
+    # Os metadados vêm do índice da pasta, então a busca é feita aqui mesmo
+    arquivos = {}
+    for nome in dict.fromkeys(nome for nome in nomes if nome):
+        try:
+            arquivos[nome] = localizar_imagem(nome, pasta_id)
+        except Exception as e:
+            st.error(f"Erro ao baixar imagem '{nome}': {e}")
+            arquivos[nome] = None
+    por_id = {info['id']: info for info in arquivos.values() if info}
+
+    def baixar(info):
+        return obter_rendicao(info['id'], info.get('md5Checksum'), info.get('modifiedTime'), tipo)
+
+    # Cada thread usa a própria conexão com o Drive (ver obter_drive_service)
+    conteudos = {}
+    with ThreadPoolExecutor(max_workers=DOWNLOADS_PARALELOS) as executor:
+        futuros = {file_id: executor.submit(baixar, info) for file_id, info in por_id.items()}
+        for file_id, futuro in futuros.items():
+            try:
+                conteudos[file_id] = futuro.result()
+            except Exception as e:
+                st.error(f"Erro ao baixar imagem '{por_id[file_id]['name']}': {e}")
+                conteudos[file_id] = None
+
+    return {nome: conteudos.get(info['id']) if info else None for nome, info in arquivos.items()}
+
+def adicionar_imagem_ao_pdf(imagem_pdf, nome_imagem, pdf, x, y, largura):
+    """Adiciona ao PDF a versão "pdf" (já baixada) de uma estampa; devolve o motivo se não conseguir"""
+    # Sem chamar o Streamlit: o PDF pode estar sendo montado em uma thread, onde st.error se perde
+    if not imagem_pdf:
+        return f"Imagem '{nome_imagem}' não pôde ser baixada"
     try:
-        # Baixar a imagem usando sua função existente
-        imagem_pil = baixar_imagem_por_nome(nome_imagem, pasta_id)
-        
-        if imagem_pil:
-            # Criar arquivo temporário
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                # Converter e salvar como JPEG
-                if imagem_pil.mode in ('RGBA', 'LA'):
-                    # Se tem transparência, converter para RGB
-                    background = Image.new('RGB', imagem_pil.size, (255, 255, 255))
-                    background.paste(imagem_pil, mask=imagem_pil.split()[-1])
-                    imagem_pil = background
-                
-                imagem_pil.save(temp_file, format='JPEG', quality=85)
-                temp_path = temp_file.name
-            
-            # Adicionar ao PDF
-            pdf.image(temp_path, x=x, y=y, w=largura)
-            
-            # Limpar arquivo temporário
-            os.unlink(temp_path)
-            return True
-        else:
-            st.error(f"Imagem '{nome_imagem}' não pôde ser baixada")
-            return False
-            
+        # O fpdf2 reaproveita a mesma imagem quando a estampa se repete no PDF
+        pdf.image(io.BytesIO(imagem_pdf), x=x, y=y, w=largura)
     except Exception as e:
-        st.error(f"Erro ao adicionar '{nome_imagem}' ao PDF: {e}")
-        return False
-    
-def salvar_pdf_no_drive(pdf, nome_arquivo, pasta_id):
+        return f"Erro ao adicionar '{nome_imagem}' ao PDF: {e}"
+    return None
+
+## Envio dos PDFs para o Drive ##
+# PDFs ainda não confirmados pelo Drive ficam aqui, junto com a sessão de upload, até o envio terminar
+PASTA_ENVIOS = os.path.join(PASTA_CACHE, "envios")
+
+# Tamanho de cada bloco do upload retomável (o Drive exige múltiplos de 256 KiB)
+TAMANHO_BLOCO_ENVIO = 4 * 256 * 1024
+
+# Tentativas por bloco antes de desistir (com espera exponencial entre elas)
+TENTATIVAS_ENVIO = int(st.secrets.get("tentativas_envio", 6))
+
+CAMPOS_PDF_ENVIADO = 'id, name, webViewLink, webContentLink'
+
+@st.cache_resource
+def envios_em_andamento():
+    """Envios sendo feitos agora neste processo, para não retomar o mesmo envio duas vezes"""
+    return {"lock": threading.Lock(), "chaves": set()}
+
+def _caminho_envio(chave, extensao):
+    return os.path.join(PASTA_ENVIOS, f"{chave}.{extensao}")
+
+def _gravar_envio(chave, registro, conteudo=None):
+    """Guarda em disco o PDF e o estado do envio; sem disco gravável o envio segue só em memória"""
+    try:
+        if conteudo is not None:
+            _gravar_arquivo_cache(_caminho_envio(chave, "pdf"), conteudo, f"{chave}.pdf")
+        _gravar_arquivo_cache(_caminho_envio(chave, "json"),
+                              json.dumps(registro, ensure_ascii=False).encode("utf-8"), f"{chave}.json")
+    except OSError as e:
+        print(f"Não foi possível guardar o envio {registro['nome']}: {e}")  # Debug
+
+def _encerrar_envio(chave):
+    """Apaga o PDF e o estado de um envio concluído"""
+    for extensao in ("json", "pdf"):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(_caminho_envio(chave, extensao))
+
+def envios_pendentes():
+    """Envios que ficaram pela metade (falha de rede, reinício do app), do mais antigo ao mais novo"""
+    pendentes = []
+    for caminho in glob.glob(os.path.join(PASTA_ENVIOS, "*.json")):
+        chave = os.path.splitext(os.path.basename(caminho))[0]
+        try:
+            with open(caminho, encoding="utf-8") as f:
+                pendentes.append((chave, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return sorted(pendentes, key=lambda pendente: pendente[1]["criado_em"])
+
+def _erro_envio_temporario(erro):
+    """Diz se vale a pena tentar de novo um bloco do upload que deu este erro"""
+    if isinstance(erro, HttpError):
+        return erro.resp.status in CODIGOS_ERRO_TEMPORARIO
+    return isinstance(erro, (OSError, httplib2.HttpLib2Error))
+
+def _requisicao_envio(chave, registro, conteudo):
+    """Monta a requisição de upload retomável, marcando o arquivo com o código da OS"""
+    file_metadata = {
+        'name': registro["nome"],
+        'parents': [registro["pasta_id"]],
+    }
+    if registro["codigos_os"]:
+        # Permite achar o PDF de uma OS no Drive mesmo que a resposta do upload tenha se perdido
+        file_metadata['appProperties'] = {'codigo_os': str(registro["codigos_os"][0])}
+
+    caminho_pdf = _caminho_envio(chave, "pdf")
+    if os.path.exists(caminho_pdf):
+        # Lendo do PDF guardado em disco a requisição pode ser salva com to_json() e retomada após um reinício
+        media = MediaFileUpload(caminho_pdf, mimetype='application/pdf',
+                                chunksize=TAMANHO_BLOCO_ENVIO, resumable=True)
+    else:
+        media = MediaIoBaseUpload(io.BytesIO(conteudo), mimetype='application/pdf',
+                                  chunksize=TAMANHO_BLOCO_ENVIO, resumable=True)
+    return obter_drive_service().files().create(
+        body=file_metadata,
+        media_body=media,
+        supportsAllDrives=True,  # ← CRÍTICO
+        fields=CAMPOS_PDF_ENVIADO
+    )
+
+def _procurar_pdf_enviado(registro):
+    """PDF da OS que já chegou ao Drive em uma tentativa anterior, se houver"""
+    if not registro["codigos_os"]:
+        return None
+    query = (f"'{registro['pasta_id']}' in parents and trashed = false and "
+             f"appProperties has {{ key='codigo_os' and value='{registro['codigos_os'][0]}' }}")
+    arquivos = obter_drive_service().files().list(
+        q=query,
+        fields=f"files({CAMPOS_PDF_ENVIADO})",
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True
+    ).execute().get('files', [])
+    return arquivos[0] if arquivos else None
+
+def _progresso_no_drive(request):
+    """Pergunta ao Drive quantos bytes da sessão já chegaram; devolve o arquivo se o envio já terminou"""
+    resp, content = request.http.request(
+        request.resumable_uri, "PUT",
+        headers={"Content-Range": f"bytes */{request.resumable.size()}", "content-length": "0"}
+    )
+    if resp.status in (200, 201):
+        return request.postproc(resp, content)
+    if resp.status != 308:
+        raise HttpError(resp, content, uri=request.uri)
+    # O cabeçalho Range ("bytes=0-N") só vem quando o Drive já recebeu alguma coisa
+    request.resumable_progress = int(resp["range"].split("-")[1]) + 1 if "range" in resp else 0
+    return None
+
+def _restaurar_requisicao(registro, nova):
+    """Refaz a requisição salva de um envio interrompido, continuando de onde o Drive parou"""
+    request = HttpRequest.from_json(registro["requisicao"], nova.http, nova.postproc)
+    # from_json() não traz a sessão de upload, só a requisição; o endereço dela vem do JSON salvo
+    request.resumable_uri = json.loads(registro["requisicao"])["resumable_uri"]
+    return request, _progresso_no_drive(request)
+
+def _executar_envio(chave, registro, conteudo):
+    """Envia o PDF em blocos, continuando a sessão salva quando existe uma"""
+    request = _requisicao_envio(chave, registro, conteudo)
+    retomar = bool(registro.get("requisicao"))
+
+    resposta = None
+    while resposta is None:
+        try:
+            for tentativa in Retrying(
+                retry=retry_if_exception(_erro_envio_temporario),
+                wait=wait_exponential(multiplier=1, max=30),
+                stop=stop_after_attempt(TENTATIVAS_ENVIO),
+                reraise=True,
+            ):
+                with tentativa:
+                    if retomar:
+                        request, resposta = _restaurar_requisicao(registro, request)
+                        retomar = False
+                    else:
+                        # Depois de uma falha o próprio next_chunk pergunta ao Drive até onde o bloco chegou
+                        _, resposta = request.next_chunk()
+        except HttpError as e:
+            if not registro.get("requisicao") or e.resp.status not in (404, 410):
+                raise
+            # A sessão expirou: confere se o arquivo chegou a ser criado antes de recomeçar do zero
+            resposta = _procurar_pdf_enviado(registro)
+            registro["requisicao"] = None
+            retomar = False
+            request = _requisicao_envio(chave, registro, conteudo)
+            continue
+
+        if resposta is None and isinstance(request.resumable, MediaFileUpload):
+            # Salva a requisição a cada bloco para um reinício continuar do último bloco confirmado
+            registro["requisicao"] = request.to_json()
+            _gravar_envio(chave, registro)
+
+    return resposta
+
+def vincular_pdf_as_os(codigos_os, arquivo):
+    """Grava o link do PDF nas linhas das OS, criando a coluna "PDF" na aba OS se ela ainda não existir"""
+    if not codigos_os or not arquivo.get('webViewLink'):
+        return
+
+    aba = obter_aba("OS")
+    cabecalho = aba.row_values(1)
+    if "Código OS" not in cabecalho:
+        raise ValueError('a aba OS não tem a coluna "Código OS" para localizar as linhas')
+    if "PDF" not in cabecalho:
+        if aba.col_count <= len(cabecalho):
+            aba.add_cols(1)
+        aba.update_cell(1, len(cabecalho) + 1, "PDF")
+        cabecalho.append("PDF")
+
+    # Procura as linhas pelo código, que não muda mesmo se linhas forem apagadas depois
+    codigos_planilha = aba.col_values(cabecalho.index("Código OS") + 1)
+    coluna_pdf = rowcol_to_a1(1, cabecalho.index("PDF") + 1)[:-1]
+    codigos = {str(codigo) for codigo in codigos_os}
+    atualizacoes = [
+        {"range": f"{coluna_pdf}{linha}", "values": [[arquivo['webViewLink']]]}
+        for linha, codigo in enumerate(codigos_planilha, start=1)
+        if linha > 1 and str(codigo) in codigos
+    ]
+    if atualizacoes:
+        aba.batch_update(atualizacoes)
+        invalidar_aba("OS")
+
+def _concluir_envio(chave, registro, conteudo):
+    """Envia um PDF, liga o arquivo às OS e apaga o que estava guardado do envio"""
+    andamento = envios_em_andamento()
+    with andamento["lock"]:
+        if chave in andamento["chaves"]:
+            raise RuntimeError(f"O envio de {registro['nome']} já está em andamento")
+        andamento["chaves"].add(chave)
+
+    try:
+        arquivo = _executar_envio(chave, registro, conteudo)
+        try:
+            vincular_pdf_as_os(registro["codigos_os"], arquivo)
+        except Exception as e:
+            # O PDF já está no Drive (e marcado com o código da OS); o link na planilha é um extra
+            print(f"Não foi possível gravar o link de {registro['nome']} na aba OS: {e}")  # Debug
+        _encerrar_envio(chave)
+        return arquivo
+    finally:
+        with andamento["lock"]:
+            andamento["chaves"].discard(chave)
+
+def enviar_pdf_para_drive(conteudo, nome_arquivo, pasta_id, codigos_os=()):
+    """Envia os bytes de um PDF para a pasta do Drive e devolve os metadados do arquivo criado"""
+    chave = uuid.uuid4().hex
+    registro = {
+        "nome": nome_arquivo,
+        "pasta_id": pasta_id,
+        "codigos_os": [str(codigo) for codigo in codigos_os],
+        "requisicao": None,  # HttpRequest.to_json() da sessão de upload, depois do primeiro bloco
+        "criado_em": time.time(),
+    }
+    # O PDF fica em disco até o Drive confirmar, para poder ser retomado depois de uma falha
+    _gravar_envio(chave, registro, conteudo)
+    return _concluir_envio(chave, registro, conteudo)
+
+def retomar_envio(chave, registro):
+    """Retoma um envio pendente, a partir da sessão salva ou do início"""
+    if not registro.get("requisicao"):
+        # Sem sessão salva não dá para saber se o arquivo chegou: confere antes de enviar de novo
+        arquivo = _procurar_pdf_enviado(registro)
+        if arquivo:
+            vincular_pdf_as_os(registro["codigos_os"], arquivo)
+            _encerrar_envio(chave)
+            return arquivo
+
+    with open(_caminho_envio(chave, "pdf"), "rb") as f:
+        conteudo = f.read()
+    return _concluir_envio(chave, registro, conteudo)
+
+def mostrar_envios_pendentes():
+    """Mostra na barra lateral os PDFs que não terminaram de subir, com opção de retomar"""
+    pendentes = [
+        (chave, registro) for chave, registro in envios_pendentes()
+        if chave not in envios_em_andamento()["chaves"]
+    ]
+    if not pendentes:
+        return
+
+    st.sidebar.warning(f"{len(pendentes)} PDF(s) de OS ainda não chegaram ao Drive.")
+    if st.sidebar.button("Retomar envios"):
+        for chave, registro in pendentes:
+            try:
+                arquivo = retomar_envio(chave, registro)
+                st.sidebar.success(f"{arquivo['name']} enviado.")
+            except Exception as e:
+                st.sidebar.error(f"{registro['nome']}: {e}")
+
+def salvar_pdf_no_drive(pdf, nome_arquivo, pasta_id, codigos_os=()):
     """Salva PDF em Shared Drive (solução recomendada)"""
     try:
-        # Salvar temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            pdf.output(temp_file.name)
-            temp_path = temp_file.name
-        
-        # Metadados
-        file_metadata = {
-            'name': nome_arquivo,
-            'parents': [pasta_id]
-        }
-        
-        # Upload com suporte a Shared Drives
-        media = MediaFileUpload(temp_path, mimetype='application/pdf', resumable=True)
-        
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            supportsAllDrives=True,  # ← CRÍTICO
-            fields='id, name, webViewLink, webContentLink'
-        ).execute()
-        
-        # Limpeza
-        os.unlink(temp_path)
+        # O PDF é montado em memória; só vai para o disco como garantia até o upload terminar
+        file = enviar_pdf_para_drive(bytes(pdf.output()), nome_arquivo, pasta_id, codigos_os)
         
         st.success(f"✅ OS salva com sucesso!")
         st.write(f"**Arquivo:** {file['name']}")
@@ -193,36 +702,654 @@ def salvar_pdf_no_drive(pdf, nome_arquivo, pasta_id):
         st.write("- Você está usando o ID correto do Shared Drive")
         return None
 
-client = gspread.authorize(creds) #Acessando sheets
+## Snapshot local das planilhas ##
+# Cópia das últimas linhas lidas de cada aba, usada para mostrar dados logo depois de um reinício do app
+PASTA_SNAPSHOTS = os.path.join(PASTA_CACHE, "snapshots")
+ARQUIVO_MANIFESTO = os.path.join(PASTA_SNAPSHOTS, "manifesto.json")
+
+# Intervalo mínimo (em segundos) entre duas gravações do snapshot de uma mesma aba
+INTERVALO_SNAPSHOTS = int(st.secrets.get("intervalo_snapshots", 600))
+
+@st.cache_resource
+def estado_snapshots():
+    """Estado compartilhado entre as sessões sobre os snapshots já servidos e reconciliados"""
+    return {
+        "lock": threading.Lock(),
+        "servidos": set(),      # abas cujo snapshot já foi usado neste processo
+        "reconciliados": {},    # aba -> dados lidos do Sheets em segundo plano, ainda não entregues
+        "geracao": {},          # aba -> contador de escritas feitas pelo app
+    }
+
+def _ler_manifesto():
+    """Manifesto com o cabeçalho, a quantidade de linhas, a versão e a data de alteração da planilha de cada snapshot"""
+    try:
+        with open(ARQUIVO_MANIFESTO, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-planilha_completa = client.open(
-    title="Plastcor_Estampas", 
-    folder_id="1CEp2KbtqQnOx3beI2aseUxjPZ1AWe8J6"
-    )
+def salvar_snapshot(nome_aba, cabecalho, linhas, versao, modificado_em):
+    """Grava as linhas brutas de uma aba em Parquet e registra o snapshot no manifesto"""
+    estado = estado_snapshots()
+
+    try:
+        with estado["lock"]:
+            manifesto = _ler_manifesto()
+            anterior = manifesto.get(nome_aba, {})
+            if anterior.get("versao") == versao or (modificado_em and anterior.get("modificado_em") == modificado_em):
+                return  # Nada mudou desde o último snapshot
+            if time.time() - anterior.get("salvo_em", 0) < INTERVALO_SNAPSHOTS:
+                # Cada sincronização com linhas novas regravaria o arquivo inteiro; um snapshot
+                # um pouco antigo basta, já que ele é conferido com o Sheets depois de um reinício
+                return
+
+            tabela = pa.table({
+                f"c{i}": pa.array([linha[i] for linha in linhas], type=pa.string())
+                for i in range(len(cabecalho))
+            })
+            os.makedirs(PASTA_SNAPSHOTS, exist_ok=True)
+            caminho = os.path.join(PASTA_SNAPSHOTS, f"{nome_aba}.parquet")
+            with tempfile.NamedTemporaryFile(dir=PASTA_SNAPSHOTS, delete=False) as temp_file:
+                pq.write_table(tabela, temp_file)
+            os.replace(temp_file.name, caminho)
+
+            manifesto[nome_aba] = {
+                "cabecalho": cabecalho,
+                "linhas": len(linhas),
+                "ultima_linha": linhas[-1] if linhas else None,
+                "versao": versao,
+                "modificado_em": modificado_em,  # modifiedTime da planilha (Drive) quando as linhas foram lidas
+                "salvo_em": time.time(),
+            }
+            _gravar_arquivo_cache(ARQUIVO_MANIFESTO,
+                                  json.dumps(manifesto, ensure_ascii=False).encode("utf-8"),
+                                  "manifesto.json")
+    except OSError as e:
+        # Sem disco gravável o app segue lendo só do Sheets
+        print(f"Não foi possível gravar o snapshot de {nome_aba}: {e}")  # Debug
+
+def ler_snapshot(nome_aba):
+    """Lê o snapshot de uma aba (mapeado em memória) ou devolve None se não houver um válido"""
+    info = _ler_manifesto().get(nome_aba)
+    if not info:
+        return None
+
+    try:
+        tabela = pq.read_table(os.path.join(PASTA_SNAPSHOTS, f"{nome_aba}.parquet"), memory_map=True)
+    except (OSError, pa.ArrowException):
+        return None
+    # Parquet e manifesto de gravações diferentes (queda no meio da gravação): ignora o snapshot
+    if tabela.num_rows != info["linhas"] or tabela.num_columns != len(info["cabecalho"]):
+        return None
 
-planilhaProducao = planilha_completa.get_worksheet(0) #Obtendo planilha Real
-planilhaQuadro = planilha_completa.get_worksheet(1) #Obtendo planilha Real
-planilhaFalta = planilha_completa.get_worksheet(2) #Obtendo planilha Real
-planilhaOS = planilha_completa.get_worksheet(3) #Obtendo planilha Real
+    colunas = [tabela.column(i).to_pylist() for i in range(tabela.num_columns)]
+    linhas = [list(linha) for linha in zip(*colunas)]
+    return {**info, "linhas": linhas}
 
-dados_Producao_completo = planilhaProducao.get_all_records()
-dados_Quadro_completo = planilhaQuadro.get_all_records() #Obtendo todos os dados da planilha
-dados_Falta_completo = planilhaFalta.get_all_records() #Obtendo todos os dados da planilha
-dados_os_completo = planilhaOS.get_all_records() #Obtendo todos os dados da planilha
+def snapshot_de_partida(nome_aba):
+    """Na primeira leitura da aba neste processo, devolve o snapshot local em vez de esperar o Sheets"""
+    estado = estado_snapshots()
+    with estado["lock"]:
+        if nome_aba in estado["servidos"]:
+            return None
+        estado["servidos"].add(nome_aba)
+
+    snapshot = ler_snapshot(nome_aba)
+    if snapshot is None:
+        return None
+
+    if nome_aba == "Producao":
+        # A sincronização incremental continua a partir do snapshot
+        return semear_producao(snapshot)
+
+    dados = _linhas_para_dataframe(snapshot["cabecalho"], snapshot["linhas"])
+    dados.attrs["versao"] = snapshot["versao"]
+    return dados
+
+def reconciliar_snapshot(nome_aba):
+    """Lê a aba no Sheets em segundo plano e troca o snapshot servido pelos dados atuais"""
+    estado = estado_snapshots()
+    with estado["lock"]:
+        geracao = estado["geracao"].get(nome_aba, 0)
+
+    try:
+        salvo = _ler_manifesto().get(nome_aba, {}).get("modificado_em")
+        if salvo and salvo == obter_planilha().get_lastUpdateTime():
+            return  # A planilha não mudou desde o snapshot: ele já é o estado atual
+        dados = _ler_e_salvar(nome_aba)
+    except Exception as e:
+        print(f"Falha ao reconciliar {nome_aba} com o Sheets: {e}")  # Debug
+        dados = None
+
+    with estado["lock"]:
+        # Uma escrita do app durante a leitura já invalidou a aba; não publicamos dados velhos
+        if dados is None or estado["geracao"].get(nome_aba, 0) != geracao:
+            return
+        estado["reconciliados"][nome_aba] = dados
+    carregar_aba.clear(nome_aba)
+
+def _ler_aba(nome_aba):
+    """Lê uma aba no Sheets, devolvendo os dados, as linhas brutas e a data de alteração para o snapshot"""
+    if nome_aba == "Producao":
+        sincronizar_producao()
+        estado = estado_sync_producao()
+        with estado["lock"]:
+            return estado["dados"], estado["cabecalho"], estado["linhas"], estado["modificado_em"]
+
+    # Lida antes das linhas: se a planilha mudar no meio, o snapshot fica com a data antiga e é relido
+    modificado_em = obter_planilha().get_lastUpdateTime()
+    valores = obter_aba(nome_aba).get_all_values()
+    cabecalho = valores[0] if valores else []
+    linhas = [_completar_linha(linha, len(cabecalho))[:len(cabecalho)] for linha in valores[1:]]
+    dados = _linhas_para_dataframe(cabecalho, linhas) #Colocando dados no formato de dataframe
+    # Identifica esta leitura para os caches derivados dela
+    dados.attrs["versao"] = f"{nome_aba}-{time.time_ns()}"
+    return dados, cabecalho, linhas, modificado_em
+
+def _ler_e_salvar(nome_aba):
+    """Lê uma aba no Sheets e atualiza o snapshot local dela"""
+    dados, cabecalho, linhas, modificado_em = _ler_aba(nome_aba)
+    salvar_snapshot(nome_aba, cabecalho, linhas, versao_dados(dados), modificado_em)
+    return dados
+
+## Cache das planilhas ##
+# Tempo máximo (em segundos) que os dados ficam em memória antes de uma nova leitura
+TTL_PLANILHAS = int(st.secrets.get("ttl_planilhas", 300))
+
+# Intervalo (em segundos) para uma releitura completa da Produção, por garantia: edições manuais
+# são percebidas antes disso pela data de alteração da planilha no Drive
+RECARGA_COMPLETA_PRODUCAO = int(st.secrets.get("recarga_completa_producao", 3600))
+
+@st.cache_data(ttl=TTL_PLANILHAS, show_spinner=False)
+def carregar_aba(nome_aba):
+    """Lê todos os registros de uma aba uma vez por processo, compartilhado entre as sessões"""
+    estado = estado_snapshots()
+    with estado["lock"]:
+        reconciliado = estado["reconciliados"].pop(nome_aba, None)
+    if reconciliado is not None:
+        return reconciliado
+
+    # Logo após um reinício mostramos o snapshot local e buscamos o Sheets em segundo plano
+    snapshot = snapshot_de_partida(nome_aba)
+    if snapshot is not None:
+        threading.Thread(target=reconciliar_snapshot, args=(nome_aba,), daemon=True).start()
+        return snapshot
+
+    return _ler_e_salvar(nome_aba)
+
+def versao_dados(dados):
+    """Versão de um DataFrame devolvido por carregar_aba (muda sempre que os dados mudam)"""
+    return dados.attrs.get("versao")
+
+def invalidar_aba(nome_aba, recarga_completa=False):
+    """Descarta o cache de uma aba depois de uma escrita feita pelo próprio app"""
+    if recarga_completa and nome_aba == "Producao":
+        estado_sync_producao()["forcar_completo"] = True
+    # Qualquer escrita muda a data de alteração da planilha; esta não exige reler a Produção inteira
+    estado_sync_producao()["escrita_do_app"] = True
+    estado = estado_snapshots()
+    with estado["lock"]:
+        estado["geracao"][nome_aba] = estado["geracao"].get(nome_aba, 0) + 1
+        estado["reconciliados"].pop(nome_aba, None)
+    carregar_aba.clear(nome_aba)
+
+## Sincronização incremental da Produção ##
+@st.cache_resource
+def estado_sync_producao():
+    """Estado compartilhado entre as sessões com o que já foi lido da aba de Produção"""
+    return {
+        "lock": threading.Lock(),
+        "dados": None,
+        "cabecalho": [],
+        "total_linhas": 0,       # linhas de dados já ingeridas (sem o cabeçalho)
+        "ultima_linha": None,    # valores brutos da última linha ingerida
+        "linhas": [],            # valores brutos de todas as linhas, usados no snapshot
+        "carregado_em": 0.0,
+        "forcar_completo": False,
+        "modificado_em": None,   # modifiedTime da planilha (Drive) na última leitura
+        "escrita_do_app": False, # o app gravou na planilha desde a última leitura
+        "versao": 0,
+    }
+
+def _publicar_producao(estado, dados):
+    """Guarda os dados sincronizados marcando uma nova versão"""
+    estado["versao"] += 1
+    # O instante entra na versão para não repetir a de um snapshot gravado antes de um reinício
+    dados.attrs["versao"] = f"Producao-{estado['versao']}-{time.time_ns()}"
+    estado["dados"] = dados
+
+def _recarregar_producao(estado, modificado_em=None):
+    """Lê a aba de Produção inteira e reinicia o estado da sincronização"""
+    # A data de alteração é lida antes das linhas: o que mudar no meio fica para a próxima sincronização
+    estado["modificado_em"] = modificado_em or obter_planilha().get_lastUpdateTime()
+    estado["escrita_do_app"] = False
+    valores = obter_aba("Producao").get_all_values()
+    cabecalho = valores[0] if valores else []
+    # Mesmo formato de _ler_aba e da leitura da âncora: exatamente a largura do cabeçalho
+    linhas = [_completar_linha(linha, len(cabecalho))[:len(cabecalho)] for linha in valores[1:]]
+
+    estado["cabecalho"] = cabecalho
+    estado["total_linhas"] = len(linhas)
+    estado["ultima_linha"] = linhas[-1] if linhas else None
+    estado["linhas"] = linhas
+    _publicar_producao(estado, _linhas_para_dataframe(cabecalho, linhas))
+    estado["carregado_em"] = time.time()
+    estado["forcar_completo"] = False
+
+def semear_producao(snapshot):
+    """Inicia a sincronização a partir de um snapshot local, como se ele tivesse acabado de ser lido"""
+    estado = estado_sync_producao()
+    with estado["lock"]:
+        if estado["dados"] is None:
+            estado["cabecalho"] = snapshot["cabecalho"]
+            estado["linhas"] = snapshot["linhas"]
+            estado["total_linhas"] = len(snapshot["linhas"])
+            estado["ultima_linha"] = snapshot["ultima_linha"]
+            estado["modificado_em"] = snapshot.get("modificado_em")
+            _publicar_producao(estado, _linhas_para_dataframe(snapshot["cabecalho"], snapshot["linhas"]))
+            # A idade do snapshot conta para a releitura completa periódica
+            estado["carregado_em"] = snapshot["salvo_em"]
+        return estado["dados"]
+
+def _completar_linha(linha, tamanho):
+    """A API omite células vazias no fim da linha, então completamos até o tamanho do cabeçalho"""
+    return list(linha) + [""] * (tamanho - len(linha))
+
+def _linhas_para_dataframe(cabecalho, linhas):
+    """Converte linhas brutas no mesmo formato de get_all_records (números convertidos)"""
+    registros = to_records(cabecalho, [numericise_all(linha) for linha in linhas])
+    return pd.DataFrame(registros, columns=cabecalho or None)
+
+def sincronizar_producao():
+    """Traz só as linhas novas da Produção; relê tudo quando a planilha foi alterada fora do app"""
+    estado = estado_sync_producao()
+
+    with estado["lock"]:
+        expirou = time.time() - estado["carregado_em"] > RECARGA_COMPLETA_PRODUCAO
+        if estado["dados"] is None or estado["forcar_completo"] or expirou or not estado["cabecalho"]:
+            _recarregar_producao(estado)
+            return estado["dados"]
+
+        # O Drive guarda a data da última alteração da planilha inteira, seja de quem for
+        modificado_em = obter_planilha().get_lastUpdateTime()
+        if modificado_em == estado["modificado_em"]:
+            return estado["dados"]  # Ninguém mexeu na planilha desde a última leitura
+        if not estado["escrita_do_app"]:
+            # Alteração feita direto no Sheets: pode ter sido em qualquer linha antiga, então relemos tudo
+            _recarregar_producao(estado, modificado_em)
+            return estado["dados"]
+        # Só o app gravou (novas linhas vão para o fim): basta ler a partir da última linha conhecida
+        estado["escrita_do_app"] = False
+        estado["modificado_em"] = modificado_em
+
+        # Relê a partir da última linha já ingerida: ela serve de âncora para detectar edições
+        linha_ancora = estado["total_linhas"] + 1  # +1 por causa do cabeçalho
+        ultima_coluna = rowcol_to_a1(1, len(estado["cabecalho"]))[:-1]
+        valores = obter_aba("Producao").get(f"A{linha_ancora}:{ultima_coluna}")
+        # Linhas em branco no meio são mantidas, como na leitura completa, para a contagem bater
+        valores = [_completar_linha(linha, len(estado["cabecalho"]))[:len(estado["cabecalho"])] for linha in valores]
+
+        # Sem dados ainda, a âncora é o próprio cabeçalho (linha 1)
+        ancora_esperada = estado["ultima_linha"] if estado["total_linhas"] else estado["cabecalho"]
+        ancora_atual = valores[0] if valores else None
+        if ancora_atual != ancora_esperada:
+            # A última linha conhecida mudou ou sumiu: houve edição/remoção, então relemos tudo
+            _recarregar_producao(estado)
+            return estado["dados"]
+
+        novas = valores[1:]
+        if novas:
+            _publicar_producao(estado, pd.concat(
+                [estado["dados"], _linhas_para_dataframe(estado["cabecalho"], novas)],
+                ignore_index=True
+            ))
+            estado["total_linhas"] += len(novas)
+            estado["ultima_linha"] = novas[-1]
+            estado["linhas"] = estado["linhas"] + novas
+
+        return estado["dados"]
+
+## Ordens de serviço ##
+# Arquivo com o último código de OS reservado neste servidor
+ARQUIVO_CONTADOR_OS = os.path.join(PASTA_CACHE, "contador_os.json")
+
+@st.cache_resource
+def trava_contador_os():
+    """Trava do processo para a reserva de códigos de OS"""
+    return threading.Lock()
+
+@contextlib.contextmanager
+def travar_arquivo(caminho, espera=10):
+    """Trava entre processos baseada na criação exclusiva de um arquivo"""
+    limite = time.time() + espera
+    while True:
+        try:
+            os.close(os.open(caminho, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                # Trava abandonada por um processo que caiu no meio da reserva
+                if time.time() - os.path.getmtime(caminho) > espera:
+                    os.unlink(caminho)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() > limite:
+                raise TimeoutError(f"Não foi possível travar {caminho}")
+            time.sleep(0.05)
+
+    try:
+        yield
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(caminho)
+
+def reservar_codigos_os(quantidade):
+    """Reserva de forma atômica um bloco de códigos de OS consecutivos e devolve o primeiro"""
+    os.makedirs(PASTA_CACHE, exist_ok=True)
+
+    # A planilha continua sendo a referência caso o contador local seja perdido
+    dados_os = carregar_aba("OS")
+    ultimo_planilha = 0
+    if not dados_os.empty:
+        ultimo_planilha = pd.to_numeric(dados_os["Código OS"], errors="coerce").max()
+        ultimo_planilha = 0 if pd.isna(ultimo_planilha) else int(ultimo_planilha)
+
+    with trava_contador_os(), travar_arquivo(ARQUIVO_CONTADOR_OS + ".lock"):
+        ultimo_reservado = 0
+        if os.path.exists(ARQUIVO_CONTADOR_OS):
+            with open(ARQUIVO_CONTADOR_OS) as f:
+                ultimo_reservado = json.load(f)["ultimo"]
+
+        primeiro = max(ultimo_reservado, ultimo_planilha) + 1
+
+        with tempfile.NamedTemporaryFile("w", dir=PASTA_CACHE, delete=False) as temp_file:
+            json.dump({"ultimo": primeiro + quantidade - 1}, temp_file)
+        os.replace(temp_file.name, ARQUIVO_CONTADOR_OS)
+
+    return primeiro
+
+def liberar_codigos_os(primeiro, quantidade):
+    """Devolve um bloco reservado que não chegou à planilha, se ninguém reservou depois dele"""
+    with trava_contador_os(), travar_arquivo(ARQUIVO_CONTADOR_OS + ".lock"):
+        try:
+            with open(ARQUIVO_CONTADOR_OS) as f:
+                ultimo_reservado = json.load(f)["ultimo"]
+        except (OSError, ValueError, KeyError):
+            return False
+        if ultimo_reservado != primeiro + quantidade - 1:
+            return False  # Já há códigos reservados depois deste bloco
+
+        with tempfile.NamedTemporaryFile("w", dir=PASTA_CACHE, delete=False) as temp_file:
+            json.dump({"ultimo": primeiro - 1}, temp_file)
+        os.replace(temp_file.name, ARQUIVO_CONTADOR_OS)
+    return True
+
+def registrar_os(linhas):
+    """Acrescenta várias OS no fim da aba com uma única requisição e devolve as linhas ocupadas"""
+    resposta = obter_aba("OS").append_rows(linhas, table_range="A1")
+    invalidar_aba("OS")
+
+    # updatedRange vem no formato "OS!A10:H12"
+    intervalo = resposta["updates"]["updatedRange"].split("!")[-1]
+    primeira, _, ultima = intervalo.partition(":")
+    linha_inicial = a1_to_rowcol(primeira)[0]
+    linha_final = a1_to_rowcol(ultima or primeira)[0]
+
+    return list(range(linha_inicial, linha_final + 1))
+
+## Fila de escritas na planilha ##
+# Lançamentos e edições são gravados primeiro em disco e enviados ao Sheets em segundo plano
+ARQUIVO_FILA_ESCRITAS = os.path.join(PASTA_CACHE, "fila_escritas.sqlite3")
+
+# Envios que falham mais vezes que isso (ou com erro que não se resolve sozinho) ficam marcados como falha
+MAX_TENTATIVAS_FILA = int(st.secrets.get("max_tentativas_fila", 8))
+
+# Códigos de resposta do Sheets que indicam erro passageiro (cota, instabilidade)
+CODIGOS_ERRO_TEMPORARIO = {408, 429, 500, 502, 503, 504}
+
+def conectar_fila():
+    """Abre o banco SQLite da fila, criando a tabela na primeira vez"""
+    os.makedirs(PASTA_CACHE, exist_ok=True)
+    conexao = sqlite3.connect(ARQUIVO_FILA_ESCRITAS, timeout=10)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("""
+        CREATE TABLE IF NOT EXISTS escritas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            aba TEXT NOT NULL,
+            tipo TEXT NOT NULL,            -- 'intervalo' (sobrescreve linhas) ou 'nova_linha' (append)
+            intervalo TEXT,
+            valores TEXT NOT NULL,         -- linha em JSON
+            recarga_completa INTEGER NOT NULL DEFAULT 0,
+            criado_em REAL NOT NULL,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            erro TEXT
+        )
+    """)
+    return conexao
+
+@st.cache_resource
+def sinal_fila():
+    """Evento que acorda o envio da fila assim que algo novo é enfileirado"""
+    return threading.Event()
+
+def _valor_json(valor):
+    """Converte números do numpy (vindos dos DataFrames) para gravar na fila"""
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+def enfileirar_escrita(aba, valores, intervalo=None, recarga_completa=False):
+    """Grava uma escrita na fila local; sem intervalo a linha entra depois da última da aba"""
+    tipo = "intervalo" if intervalo else "nova_linha"
+    linha_json = json.dumps(valores, ensure_ascii=False, default=_valor_json)
+    try:
+        with contextlib.closing(conectar_fila()) as conexao, conexao:
+            conexao.execute(
+                "INSERT INTO escritas (aba, tipo, intervalo, valores, recarga_completa, criado_em) VALUES (?, ?, ?, ?, ?, ?)",
+                (aba, tipo, intervalo, linha_json, int(recarga_completa), time.time())
+            )
+    except (sqlite3.Error, OSError) as e:
+        # Sem a fila em disco (pasta .cache sem permissão, disco cheio...), grava direto na planilha como antes
+        print(f"Fila de escritas indisponível, gravando direto na aba {aba}: {e}")  # Debug
+        _enviar_grupo(aba, tipo, [{"intervalo": intervalo, "valores": json.loads(linha_json)}])
+        invalidar_aba(aba, recarga_completa=recarga_completa)
+        return
+    sinal_fila().set()
+
+def _erro_temporario(erro):
+    """Diz se vale a pena tentar de novo o envio que deu este erro"""
+    if isinstance(erro, gspread.exceptions.APIError):
+        return erro.code in CODIGOS_ERRO_TEMPORARIO
+    return isinstance(erro, (OSError, httplib2.HttpLib2Error, requests.exceptions.RequestException))
+
+def _agrupar_escritas(registros):
+    """Junta escritas seguidas da mesma aba e do mesmo tipo, mantendo a ordem em que foram feitas"""
+    grupos = []
+    for registro in registros:
+        chave = (registro["aba"], registro["tipo"])
+        if grupos and grupos[-1][0] == chave:
+            grupos[-1][1].append(registro)
+        else:
+            grupos.append((chave, [registro]))
+    return grupos
+
+def _enviar_grupo(aba, tipo, registros):
+    """Envia um grupo de escritas da fila em uma única chamada ao Sheets"""
+    planilha = obter_aba(aba)
+    if tipo == "intervalo":
+        planilha.batch_update([
+            {"range": registro["intervalo"], "values": [registro["valores"]]} for registro in registros
+        ])
+        return
+
+    # O próprio Sheets coloca as novas linhas depois da tabela, sem precisarmos saber quantas linhas ela tem
+    planilha.append_rows([registro["valores"] for registro in registros], table_range="A1")
+
+def processar_fila():
+    """Envia tudo o que está pendente na fila; devolve quantas escritas foram enviadas"""
+    with contextlib.closing(conectar_fila()) as conexao:
+        conexao.row_factory = sqlite3.Row
+        registros = [
+            {**dict(linha), "valores": json.loads(linha["valores"])}
+            for linha in conexao.execute("SELECT * FROM escritas WHERE status = 'pendente' ORDER BY id")
+        ]
+
+        enviadas = 0
+        abas_com_falha = set()
+        for (aba, tipo), grupo in _agrupar_escritas(registros):
+            if aba in abas_com_falha:
+                continue  # Não envia o resto da aba fora de ordem
+
+            ids = [(registro["id"],) for registro in grupo]
+            try:
+                for tentativa in Retrying(
+                    retry=retry_if_exception(_erro_temporario),
+                    wait=wait_exponential(multiplier=1, max=30),
+                    stop=stop_after_attempt(4),
+                    reraise=True,
+                ):
+                    with tentativa:
+                        _enviar_grupo(aba, tipo, grupo)
+            except Exception as e:
+                # Erro definitivo, ou temporário que já passou do limite: marca e segue para a próxima aba
+                with conexao:
+                    conexao.executemany(
+                        "UPDATE escritas SET tentativas = tentativas + 1, erro = ?, "
+                        "status = CASE WHEN ? OR tentativas + 1 >= ? THEN 'falhou' ELSE 'pendente' END "
+                        "WHERE id = ?",
+                        [(str(e), not _erro_temporario(e), MAX_TENTATIVAS_FILA, id_) for (id_,) in ids]
+                    )
+                print(f"Falha ao enviar {len(grupo)} escrita(s) da aba {aba}: {e}")  # Debug
+                abas_com_falha.add(aba)
+                continue
+
+            with conexao:
+                conexao.executemany("DELETE FROM escritas WHERE id = ?", ids)
+            invalidar_aba(aba, recarga_completa=any(registro["recarga_completa"] for registro in grupo))
+            enviadas += len(grupo)
+
+    return enviadas
+
+@st.cache_resource
+def iniciar_envio_fila():
+    """Sobe, uma vez por processo, a thread que esvazia a fila de escritas"""
+    sinal = sinal_fila()
+
+    def trabalhar():
+        pausa = 2
+        while True:
+            sinal.wait(timeout=pausa)
+            sinal.clear()
+            try:
+                processar_fila()
+                # Ainda há pendências (Sheets fora do ar ou sem cota): espera cada vez mais
+                pausa = min(pausa * 2, 300) if situacao_fila()["pendentes"] else 2
+            except Exception as e:
+                # Nenhuma exceção pode escapar, senão a thread morre e a fila para de vez
+                print(f"Falha no envio da fila de escritas: {e}")  # Debug
+                pausa = min(pausa * 2, 300)
+
+    # A fila em disco pode ter sobrado de antes de um reinício
+    sinal.set()
+    thread = threading.Thread(target=trabalhar, daemon=True)
+    thread.start()
+    return thread
+
+def situacao_fila(aba=None):
+    """Quantas escritas estão pendentes e quais falharam, de uma aba ou de todas"""
+    filtro, parametros = ("WHERE aba = ?", (aba,)) if aba else ("", ())
+    with contextlib.closing(conectar_fila()) as conexao:
+        conexao.row_factory = sqlite3.Row
+        linhas = conexao.execute(f"SELECT * FROM escritas {filtro} ORDER BY id", parametros).fetchall()
+    return {
+        "pendentes": sum(1 for linha in linhas if linha["status"] == "pendente"),
+        "falhas": [dict(linha) for linha in linhas if linha["status"] == "falhou"],
+    }
+
+def mostrar_fila(aba):
+    """Mostra na barra lateral o que ainda não chegou à planilha, com opção de reenviar falhas"""
+    try:
+        situacao = situacao_fila(aba)
+    except (sqlite3.Error, OSError):
+        st.sidebar.warning("Fila de escritas indisponível: os lançamentos estão sendo gravados direto na planilha.")
+        return
+    if situacao["pendentes"]:
+        st.sidebar.info(f"{situacao['pendentes']} lançamento(s) aguardando envio para a planilha.")
+    if not situacao["falhas"]:
+        return
+
+    st.sidebar.error(f"{len(situacao['falhas'])} lançamento(s) não foram enviados.")
+    with st.sidebar.expander("Ver falhas"):
+        for falha in situacao["falhas"]:
+            st.write(f"{', '.join(map(str, json.loads(falha['valores'])))}")
+            st.caption(falha["erro"])
+        col1, col2 = st.columns(2)
+        if col1.button("Reenviar", key=f"reenviar_{aba}"):
+            with contextlib.closing(conectar_fila()) as conexao, conexao:
+                conexao.execute(
+                    "UPDATE escritas SET status = 'pendente', tentativas = 0 WHERE aba = ? AND status = 'falhou'", (aba,)
+                )
+            sinal_fila().set()
+            st.rerun()
+        if col2.button("Descartar", key=f"descartar_{aba}"):
+            with contextlib.closing(conectar_fila()) as conexao, conexao:
+                conexao.execute("DELETE FROM escritas WHERE aba = ? AND status = 'falhou'", (aba,))
+            st.rerun()
+
+## Dados usados por cada página ##
+# Cada página só lê as abas de que precisa
+ABAS_POR_PAGINA = {
+    "Home": ["Producao"],
+    "Ordem de Serviço": ["OS", "Quadro"],
+    "Produção": ["Producao", "Quadro", "Falta"],
+    "Fechar Ordem de Serviço": ["OS"],
+    "Ver ordens de Serviço": ["OS"],
+    "Quadro de Funcionários": ["Quadro"],
+    "Falta": ["Quadro", "Falta"],
+    "Estampas": [],
+}
+
+# Páginas que mostram ou imprimem estampas
+PAGINAS_COM_ESTAMPAS = ["Ordem de Serviço", "Estampas"]
+
+def dados_da_pagina(nome_aba):
+    """Carrega a aba se a página atual usa ela (None caso contrário)"""
+    if nome_aba in ABAS_POR_PAGINA.get(pagina, []):
+        return carregar_aba(nome_aba)
+    return None
+
+## Tratamento de dados ##
+iniciar_envio_fila()
+
+dados_Producao_completo = dados_da_pagina("Producao") #Obtendo todos os dados da planilha
+dados_Quadro_completo = dados_da_pagina("Quadro") #Obtendo todos os dados da planilha
+dados_Falta_completo = dados_da_pagina("Falta") #Obtendo todos os dados da planilha
+dados_os_completo = dados_da_pagina("OS") #Obtendo todos os dados da planilha
+
+## Estampas ##
+if pagina in PAGINAS_COM_ESTAMPAS:
+    imagens = listar_imagens_na_pasta(st.secrets["id_imagens"])
+    pregerar_rendicoes(imagens)
+else:
+    imagens = []
+
+nomes_sem_extensao = [imagem['name'].rsplit('.', 1)[0] for imagem in imagens]
+
+nomes_com_extensao = [imagem['name'] for imagem in imagens]
+
+nomes_com_b = [imagem['name'].rsplit('.', 1)[0] for imagem in imagens if imagem['name'].startswith('b_')]
+
+mapeamento_estampas = dict(zip(nomes_sem_extensao, nomes_com_extensao))
+
+indice_estampas = indexar_imagens(imagens)
 
 ## Tamanhos ##
 tamanhos = [
     "P", "M", "G", "GG"
 ]
 
-## Tratamento de dados ##
-dados_Producao_completo = pd.DataFrame(dados_Producao_completo) #Colocando dados no formato de dataframe
-dados_Quadro_completo = pd.DataFrame(dados_Quadro_completo) #Colocando dados no formato de dataframe
-dados_Falta_completo = pd.DataFrame(dados_Falta_completo) #Colocando dados no formato de dataframe
-dados_os_completo = pd.DataFrame(dados_os_completo) #Colocando dados no formato de dataframe
-
 ## Equipes ##
-equipes = dados_Quadro_completo["SUBSETOR"].tolist()
+equipes = dados_Quadro_completo["SUBSETOR"].tolist() if dados_Quadro_completo is not None else []
 
 #Nomes das estampas
 nomes_estampas = nomes_sem_extensao
@@ -263,784 +1390,885 @@ class ContadorSegundos:
 def mostrar_planilha(planilha):
     st.dataframe(planilha)
 
-def create():
-    st.header("Informe os dados da OS")
+## Modelos de folha das OS ##
+# Campos de cada OS, de cima para baixo: (campo, rótulo, estilo, tamanho da fonte). Quantidade é preenchida à mão
+CAMPOS_OS = [
+    ("cliente", "Cliente: ", "B", 14),
+    ("equipe", "Equipe: ", "", 12),
+    ("estampa", "Estampa: ", "", 12),
+    ("tamanho", "Tamanho: ", "", 12),
+    (None, "Quantidade: ", "", 12),
+    ("data_entrega", "Data Entrega Prevista: ", "", 12),
+]
 
-    if not dados_os_completo.empty:
+# Na folha com uma OS só a Quantidade sempre veio antes do Tamanho
+CAMPOS_OS_FOLHA_UNICA = [
+    ("cliente", "Cliente: ", "B", 14),
+    ("equipe", "Equipe: ", "", 12),
+    ("estampa", "Estampa: ", "", 12),
+    (None, "Quantidade: ", "", 12),
+    ("tamanho", "Tamanho: ", "", 12),
+    ("data_entrega", "Data Entrega Prevista: ", "", 12),
+]
 
-        codigo = dados_os_completo.iloc[-1]["Código OS"] + 1
+# Modelos de folha: papel, campos e, para cada OS da página, a altura do texto e da área da estampa (mm)
+MODELOS_FOLHA = {
+    "1 OS por folha (A5 deitada)": {
+        "orientacao": "landscape", "formato": "A5", "altura_linha": 8, "campos": CAMPOS_OS_FOLHA_UNICA,
+        "vagas": [(10, 18)], "cortes": [],
+    },
+    "2 OS por folha (A4)": {
+        "orientacao": "portrait", "formato": "A4", "altura_linha": 7, "campos": CAMPOS_OS,
+        "vagas": [(10, 18), (155, 163)], "cortes": [148],
+    },
+    "3 OS por folha (A4)": {
+        "orientacao": "portrait", "formato": "A4", "altura_linha": 7, "campos": CAMPOS_OS,
+        "vagas": [(10, 18), (105, 103), (195, 203)], "cortes": [98, 188],
+    },
+}
+
+# Área da estampa, à direita dos textos de cada OS
+X_IMAGEM_OS = 140
+LARGURA_IMAGEM_OS = 50
+ALTURA_IMAGEM_OS = 75
+
+# Linhas reservadas para a observação; textos maiores são impressos com fonte menor
+LINHAS_OBSERVACAO = 4
+
+## Fontes das OS ##
+# Fonte Unicode (acentos, aspas e travessões); sem ela as OS usam a Arial padrão do PDF, só com Latin-1
+PASTA_FONTES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fontes")
+FONTES_OS = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf"}
+FAMILIA_OS = "DejaVu"
+FAMILIA_PADRAO_OS = "Arial"
+
+# Caracteres mantidos na versão reduzida da fonte: latim com acentos, pontuação e símbolos comuns
+CARACTERES_FONTE_OS = [*range(0x20, 0x7F), *range(0xA0, 0x180), *range(0x2010, 0x2028), 0x20AC, 0x2122, 0x2212]
+
+def _reduzir_fonte(conteudo):
+    """Gera uma cópia da fonte só com os CARACTERES_FONTE_OS, bem mais rápida de carregar"""
+    fonte = TTFont(io.BytesIO(conteudo))
+    opcoes = subset.Options()
+    opcoes.notdef_outline = True
+    opcoes.drop_tables += ["FFTM"]  # Tabela só do FontForge, sem uso no PDF
+    subsetter = subset.Subsetter(opcoes)
+    subsetter.populate(unicodes=CARACTERES_FONTE_OS)
+    subsetter.subset(fonte)
+
+    saida = io.BytesIO()
+    fonte.save(saida)
+    return saida.getvalue()
+
+@st.cache_resource(show_spinner=False)
+def fontes_os():
+    """Arquivos da fonte das OS já reduzida, gerados uma vez por versão da fonte (None se ela faltar)"""
+    caminhos = {}
+    for estilo, arquivo in FONTES_OS.items():
+        original = os.path.join(PASTA_FONTES, arquivo)
+        try:
+            with open(original, "rb") as f:
+                conteudo = f.read()
+        except OSError:
+            return None
 
-    else:
-        codigo = 1
+        nome = os.path.splitext(arquivo)[0]
+        reduzida = os.path.join(PASTA_CACHE, "fontes", f"{nome}_{hashlib.md5(conteudo).hexdigest()[:12]}.ttf")
+        if not os.path.exists(reduzida):
+            try:
+                _gravar_arquivo_cache(reduzida, _reduzir_fonte(conteudo), f"{nome}_*.ttf")
+            except OSError as e:
+                # Sem disco gravável usamos a fonte inteira
+                print(f"Não foi possível gravar {reduzida}: {e}")  # Debug
+                reduzida = original
+        caminhos[estilo] = reduzida
+    return caminhos
+
+def registrar_fontes_os(pdf):
+    """Carrega a fonte das OS no PDF e devolve a família a usar"""
+    fontes = fontes_os()
+    if not fontes:
+        return FAMILIA_PADRAO_OS
+    for estilo, caminho in fontes.items():
+        pdf.add_font(FAMILIA_OS, estilo, caminho)
+    return FAMILIA_OS
+
+def _texto_pdf(texto, familia):
+    """As fontes padrão do PDF só têm Latin-1: o que ficar de fora vira "?" em vez de dar erro"""
+    texto = str(texto)
+    if familia == FAMILIA_PADRAO_OS:
+        return texto.encode("latin-1", "replace").decode("latin-1")
+    return texto
+
+## Composição das folhas de OS ##
+def imagens_das_ordens(ordens, pasta_id):
+    """Baixa juntas, uma única vez cada, as versões "pdf" das estampas usadas nas OS"""
+    return baixar_rendicoes([ordem["estampa"] for ordem in ordens], pasta_id, tipo="pdf")
+
+@st.cache_resource
+def posicoes_folha(modelo):
+    """Coordenadas das caixas e rótulos de cada OS da página do modelo, calculadas uma única vez"""
+    config = MODELOS_FOLHA[modelo]
+    altura_linha = config["altura_linha"]
+
+    vagas = []
+    for topo, topo_imagem in config["vagas"]:
+        caixas = []
+        y = topo + 8  # abaixo do título
+        for campo, rotulo, estilo, tamanho in config["campos"]:
+            altura = 8 if estilo == "B" else altura_linha
+            caixas.append({"campo": campo, "rotulo": rotulo, "estilo": estilo, "tamanho": tamanho,
+                           "y": y, "altura": altura})
+            y += altura
+        vagas.append({
+            "topo": topo,
+            "caixas": caixas,
+            "observacao": {"y": y, "altura": altura_linha * LINHAS_OBSERVACAO, "altura_linha": altura_linha},
+            "imagem": (X_IMAGEM_OS, topo_imagem, LARGURA_IMAGEM_OS, ALTURA_IMAGEM_OS),
+        })
+
+    return {"vagas": vagas, "cortes": config["cortes"]}
+
+def desenhar_guias_de_corte(pdf, cortes, familia):
+    """Linhas de corte entre as OS de uma mesma página"""
+    for y in cortes:
+        pdf.set_draw_color(0, 0, 0)  # Cor preta
+        pdf.set_line_width(0.5)  # Espessura da linha
+        pdf.line(10, y, 200, y)
+
+        # Texto indicativo de corte
+        pdf.set_xy(85, y - 3)
+        pdf.set_font(familia, style="I" if familia == FAMILIA_PADRAO_OS else "", size=8)
+        pdf.cell(40, 5, "--- LINHA DE CORTE ---", align=Align.C)
+    pdf.set_line_width(0.2)
+
+def desenhar_parte_fixa(pdf, vaga, familia):
+    """Parte fixa de uma OS (título, caixas com os rótulos e moldura da estampa), redesenhada a cada OS"""
+    pdf.set_xy(10, vaga["topo"])
+    pdf.set_font(familia, size=12)
+    pdf.cell(130, 8, "ORDEM DE SERVIÇO", align=Align.C)
+
+    for caixa in vaga["caixas"]:
+        pdf.rect(10, caixa["y"], 130, caixa["altura"])
+        pdf.set_xy(10, caixa["y"])
+        pdf.set_font(familia, style=caixa["estilo"], size=caixa["tamanho"])
+        pdf.cell(text=caixa["rotulo"], h=caixa["altura"])
+
+    observacao = vaga["observacao"]
+    pdf.rect(10, observacao["y"], 130, observacao["altura"])
+    pdf.rect(*vaga["imagem"])
+
+def carimbar_os(pdf, vaga, ordem, familia, imagem_pdf):
+    """Escreve os dados de uma OS nas caixas já desenhadas e coloca a estampa; devolve o erro da estampa, se houver"""
+    for caixa in vaga["caixas"]:
+        if not caixa["campo"]:
+            continue
+        pdf.set_font(familia, style=caixa["estilo"], size=caixa["tamanho"])
+        # O valor começa logo depois do rótulo já desenhado
+        pdf.set_xy(10 + pdf.c_margin + pdf.get_string_width(caixa["rotulo"]), caixa["y"])
+        pdf.cell(text=_texto_pdf(ordem[caixa["campo"]], familia), h=caixa["altura"])
+
+    observacao = vaga["observacao"]
+    texto = _texto_pdf(f"Observação: {ordem['observacao']}", familia)
+    tamanho = 12
+    pdf.set_font(familia, size=tamanho)
+    # Diminui a fonte até a observação caber nas linhas reservadas
+    while tamanho > 7 and len(pdf.multi_cell(130, observacao["altura_linha"] * tamanho / 12, texto,
+                                             dry_run=True, output="LINES")) > LINHAS_OBSERVACAO:
+        tamanho -= 1
+        pdf.set_font(familia, size=tamanho)
+    pdf.set_xy(10, observacao["y"])
+    pdf.multi_cell(130, observacao["altura_linha"] * tamanho / 12, texto, align=Align.L)
+
+    x, y, largura, _ = vaga["imagem"]
+    return adicionar_imagem_ao_pdf(imagem_pdf, ordem["estampa"], pdf, x + 2, y + 2, largura - 4)
+
+def compor_folhas_os(ordens, modelo, imagens):
+    """Monta um único PDF com todas as OS, preenchendo as vagas do modelo e abrindo páginas conforme preciso.
+    Devolve o PDF e as falhas de estampa como (ordem, mensagem), para quem chamou mostrar"""
+    config = MODELOS_FOLHA[modelo]
+    posicoes = posicoes_folha(modelo)
+    vagas = posicoes["vagas"]
+
+    pdf = FPDF(config["orientacao"], "mm", config["formato"])
+    # As posições são todas fixas: nada de quebra automática de página no meio de uma OS
+    pdf.set_auto_page_break(False)
+    familia = registrar_fontes_os(pdf)
+
+    falhas = []
+    for i, ordem in enumerate(ordens):
+        vaga = vagas[i % len(vagas)]
+        if i % len(vagas) == 0:
+            pdf.add_page()
+            desenhar_guias_de_corte(pdf, posicoes["cortes"], familia)
+        desenhar_parte_fixa(pdf, vaga, familia)
+        erro = carimbar_os(pdf, vaga, ordem, familia, imagens.get(ordem["estampa"]))
+        if erro:
+            falhas.append((ordem, erro))
+
+    return pdf, falhas
 
-    codigo = int(codigo)
+def create():
+    st.header("Informe os dados da OS")
 
     # Data de hoje
     hoje = date.today()
 
     # Formata para dd/mm/yyyy
     data_carimbo = hoje.strftime("%d/%m/%Y")
-    
 
-    tipoImpressao = ["Imprimir 1 OS em uma folha", "Imprimir 2 OS em uma folha", "Imprimir 3 OS em uma folha"]
-    imprimir = st.radio("Impressão",tipoImpressao)
+    modelo = st.radio("Impressão", list(MODELOS_FOLHA))
+    quantidade_os = st.number_input("Quantas OS?", min_value=1, max_value=60,
+                                    value=len(MODELOS_FOLHA[modelo]["vagas"]), step=1)
+    mesmo_pedido = st.checkbox("Mesmo cliente, equipe e entrega para todas as OS", value=quantidade_os > 1)
 
-    if imprimir == "Imprimir 1 OS em uma folha":
-    
+    # Com uma OS só os rótulos ficam sem número
+    def rotulo(texto, i):
+        return texto.format(f" {i + 1}" if quantidade_os > 1 else "")
+
+    estampas = []
+    espacos_previa = []
+    for i in range(quantidade_os):
         st.markdown("---")
-        estampa = st.selectbox("Qual modelo de estampa?", nomes_estampas)
+        estampa = st.selectbox(rotulo("Qual modelo de estampa{}?", i), nomes_estampas, key=f"estampa_{i}")
 
         if estampa:
             estampa = mapeamento_estampas[estampa]
 
-        try:
-            imagem = baixar_imagem_por_nome(estampa, st.secrets["id_imagens"])
-            if imagem:
-
-                st.image(imagem, caption=estampa)   
-
-        except:
-            
-            st.warning("modelo não encontrado para visualização")
-
-        with st.form("AbrirOS"):
-            
-            data_entrega = st.date_input("Qual data da entrega prevista?", value="today", min_value="today")
-            data_entrega = data_entrega.strftime("%d/%m/%Y")
-            
-            #st.markdown("---")
-            #quantidade = st.number_input("Qual quantidade de camisas?", min_value = 1) #Voltar com quantidade?
-
-            st.markdown("---")
-            tamanho = st.radio("Qual tamanho do modelo?", tamanhos)
-
-            st.markdown("---")
-            cliente = st.text_input("Qual o nome do cliente?")
+        estampas.append(estampa)
+        espacos_previa.append(st.empty())
 
-            st.markdown("---")
-            equipes_filtradas = list(set([e for e in equipes if e.startswith("ESTAMPARIA")]))
-  
-            equipe = st.radio("Qual equipe responsável?", equipes_filtradas)
+    # As prévias de todas as OS são baixadas ao mesmo tempo
+    previas = baixar_rendicoes(estampas, st.secrets["id_imagens"])
+    for estampa, espaco in zip(estampas, espacos_previa):
+        if previas.get(estampa):
+            espaco.image(previas[estampa], caption=estampa)
+        else:
+            espaco.warning("modelo não encontrado para visualização")
 
-            if estampa in estampas_bordado:
-                bordado = True
-            else: 
-                bordado = False
+    with st.form("AbrirOS"):
 
-            st.markdown("---")
-            observacao = st.text_input("Observação?", max_chars=200)
+        equipes_filtradas = list(set([e for e in equipes if e.startswith("ESTAMPARIA")]))
 
+        ordens = []
+        comum = {}
+        for i, estampa in enumerate(estampas):
             st.markdown("---")
-
-            submitted = st.form_submit_button("Criar OS!")
-                
-            # Só executa quando o botão for clicado
-            if submitted:
-
-                # Pega todos os valores da primeira coluna
-                valores = planilhaOS.col_values(1)
-
-                # Descobre a primeira linha vazia
-                linha_vazia = len(valores) + 1  # +1 porque col_values não conta a próxima linha vazia
-
-                #cria nova linha
-                nova_linha = [[str(codigo), str(data_carimbo), str(data_entrega), str(estampa),
-                    #str(bordado), #str(quantidade),
-                    str(tamanho), str(cliente), str(equipe), str(observacao)]]
-
-                planilhaOS.update(f"A{linha_vazia}:K{linha_vazia}", nova_linha)
-
-                if imprimir:
-                    pdf = FPDF("landscape", "mm", "A5")
-                    pdf.add_page()
-                    pdf.set_font("Arial", size=12)
-
-                    pdf.cell(130, 8, "ORDEM DE SERVIÇO", ln=True, align=Align.C)
-                    pdf.set_font("Arial", style="B", size=14)
-                    pdf.cell(130, 8, f"Cliente: {cliente}", ln=True, border=1)  # Texto em negrito
-
-                    # Volta para a fonte normal (sem negrito)
-                    pdf.set_font("Arial", style="", size=12)
-                    pdf.cell(130, 8, f"Equipe: {equipe}", ln=True, border=True)
-                    #pdf.cell(130, 8, f"Código: {codigo}", ln=True, border=True)
-                    pdf.cell(130, 8, f"Estampa: {estampa}", ln=True, border=True)
-                    #pdf.cell(130, 8, f"Bordado: {bordado}", ln=True, border=True)
-                    #pdf.cell(130, 8, f"Quantidade: {quantidade}", ln=True, border=True)
-                    pdf.cell(130, 8, f"Quantidade: ", ln=True, border=True)
-                    pdf.cell(130, 8, f"Tamanho: {tamanho}", ln=True, border=True)
-                    #pdf.cell(130, 8, f"Data Carimbo: {data_carimbo}", ln=True, border=True)
-                    pdf.cell(130, 8, f"Data Entrega Prevista: {data_entrega}", ln=True, border=True)
-                    pdf.multi_cell(
-                        130, 8,                # largura e altura da linha
-                        f"Observação: {observacao}", 
-                        border=1,              # desenha borda
-                        align= Align.L             # alinhamento do texto
-                    )
-
-                    # Posição para começar a coluna da direita
-                    x_imagem = 140  # posição horizontal
-                    y_imagem = 18   # posição vertical
-                    largura_imagem = 50
-                    altura_imagem = 75
-
-                    # Desenha a borda grande
-                    pdf.rect(x_imagem, y_imagem, largura_imagem, altura_imagem)    
-
-                    sucesso = adicionar_imagem_ao_pdf(
-                        nome_imagem=estampa.rsplit('.', 1)[0],  # Nome SEM extensão
-                        pasta_id=st.secrets["id_imagens"],
-                        pdf=pdf,
-                        x=x_imagem+2,
-                        y=y_imagem+2,
-                        largura=largura_imagem-4
-                    )
-
-                    nome_arquivo_pdf = f"OS_{codigo}_{cliente}.pdf"
-
-                    arquivo_salvo = salvar_pdf_no_drive(
-                        pdf=pdf,
-                        nome_arquivo=nome_arquivo_pdf,
-                        pasta_id=st.secrets["id_os"]
-                    )
-
-                    if arquivo_salvo:
-                        st.success("PDF salvo com sucesso no Google Drive!")
-                        st.write(f"**Nome:** {arquivo_salvo['name']}")
-                        if arquivo_salvo.get('webViewLink'):
-                            st.write(f"**Link:** {arquivo_salvo['webViewLink']}")
-    
-    elif imprimir == "Imprimir 2 OS em uma folha":
+            if not (mesmo_pedido and comum):
+                data_entrega = st.date_input(rotulo("Qual data da entrega prevista{}?", i), value="today",
+                                             min_value="today", key=f"entrega_{i}")
+                comum = {
+                    "data_entrega": data_entrega.strftime("%d/%m/%Y"),
+                    "cliente": st.text_input(rotulo("Qual o nome do cliente{}?", i), key=f"cliente_{i}"),
+                    "equipe": st.radio(rotulo("Qual equipe responsável{}?", i), equipes_filtradas, key=f"equipe_{i}"),
+                }
+
+            ordens.append({
+                **comum,
+                "estampa": estampa,
+                "tamanho": st.radio(rotulo("Qual tamanho do modelo{}?", i), tamanhos, key=f"tamanho_{i}"),
+                "observacao": st.text_input(rotulo("Observação{}?", i), max_chars=200, key=f"observacao_{i}"),
+            })
 
         st.markdown("---")
-        estampa1 = st.selectbox("Qual modelo de estampa 1?", nomes_estampas)
 
-        if estampa1:
-            estampa1 = mapeamento_estampas[estampa1]
-
-        try:
-            imagem = baixar_imagem_por_nome(estampa1, st.secrets["id_imagens"])
-            if imagem:
-
-                st.image(imagem, caption=estampa1)   
-
-        except:
-            
-            st.warning("modelo não encontrado para visualização")
-
-        st.markdown("---")
-
-        estampa2 = st.selectbox("Qual modelo de estampa 2?", nomes_estampas)
-        if estampa2:
-            estampa2 = mapeamento_estampas[estampa2]
-
-        try:
-            imagem = baixar_imagem_por_nome(estampa2, st.secrets["id_imagens"])
-            if imagem:
-                st.image(imagem, caption=estampa2)   
-
-        except:
+        submitted = st.form_submit_button("Criar OS!")
             
-            st.warning("modelo não encontrado para visualização")
-
-        with st.form("AbrirOS"):
-            
-            data_entrega1 = st.date_input("Qual data da entrega prevista pedido 1?", value="today", min_value="today")
-            data_entrega1 = data_entrega1.strftime("%d/%m/%Y")
-
-            tamanho1 = st.radio("Qual tamanho do modelo 1?", tamanhos)
-
-            cliente1 = st.text_input("Qual o nome do cliente 1?", value="")
-
-            equipes_filtradas = list(set([e for e in equipes if e.startswith("ESTAMPARIA")]))
-            equipe1 = st.radio("Qual equipe responsável pelo pedido 1?", equipes_filtradas)
-
-            observacao1 = st.text_input("Observação modelo 1?", max_chars=200)
-
-            st.markdown("---")
-
-            data_entrega2 = st.date_input("Qual data da entrega prevista pedido 2?", value="today", min_value="today")
-            data_entrega2 = data_entrega2.strftime("%d/%m/%Y")
-            
-            #st.markdown("---")
-            #quantidade = st.number_input("Qual quantidade de camisas?", min_value = 1) #Voltar com quantidade?
-
-            tamanho2 = st.radio("Qual tamanho do modelo 2?", tamanhos)
-            
-            cliente2 = st.text_input("Qual o nome do cliente 2?", value=cliente1)
-            
-            equipe2 = st.radio("Qual equipe responsável pelo pedido 2?", equipes_filtradas)
-
-            # if estampa in estampas_bordado:
-            #     bordado = True
-            # else: 
-            #     bordado = False
-            
-            observacao2 = st.text_input("Observação modelo 2?", max_chars=200)
-
-            submitted = st.form_submit_button("Criar OS!")
-                
-            # Só executa quando o botão para clicado
-            if submitted:
-
-                # Pega todos os valores da primeira coluna
-                valores = planilhaOS.col_values(1)
-
-                # Descobre a primeira linha vazia
-                linha_vazia = len(valores) + 1  # +1 porque col_values não conta a próxima linha vazia
-
-                #cria nova linha
-                nova_linha1 = [[str(codigo), str(data_carimbo), str(data_entrega1), str(estampa1),
-                    #str(bordado), #str(quantidade),
-                    str(tamanho1), str(cliente1), str(equipe1), str(observacao1)]]
-                
-                nova_linha2 = [[str(codigo+1), str(data_carimbo), str(data_entrega2), str(estampa2),
-                    #str(bordado), #str(quantidade),
-                    str(tamanho2), str(cliente2), str(equipe2), str(observacao2)]]
-
-                planilhaOS.update(f"A{linha_vazia}:K{linha_vazia}", nova_linha1)
-                planilhaOS.update(f"A{linha_vazia+1}:K{linha_vazia+1}", nova_linha2)
-
-                if imprimir:
-                    pdf = FPDF("portrait", "mm", "A4")  # Alterado para portrait para melhor aproveitamento do espaço
-                    pdf.add_page()
-                    pdf.set_font("Arial", size=12)
-
-                    # PRIMEIRA OS (PARTE SUPERIOR)
-                    pdf.cell(130, 8, "ORDEM DE SERVIÇO", ln=True, align=Align.C)
-                    pdf.set_font("Arial", style="B", size=14)
-                    pdf.cell(130, 8, f"Cliente: {cliente1}", ln=True, border=1)
-
-                    pdf.set_font("Arial", style="", size=12)
-                    pdf.cell(130, 7, f"Equipe: {equipe1}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Estampa: {estampa1}", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Tamanho: {tamanho1}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Quantidade: ", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Data Entrega: {data_entrega1}",ln=True, border=True)
-                    #pdf.cell(95, 8, f"Código: {codigo}", ln=True, border=True)
-
-                    pdf.multi_cell(130, 7, f"Observação: {observacao1}", border=1, ln=True, align=Align.L)
-                    
-                    # Área para imagem da primeira OS
-                    x_imagem1 = 140
-                    y_imagem1 = 18
-                    largura_imagem = 50
-                    altura_imagem = 75
-
-                    pdf.rect(x_imagem1, y_imagem1, largura_imagem, altura_imagem)
-
-                    adicionar_imagem_ao_pdf(
-                        nome_imagem=estampa1.rsplit('.', 1)[0], 
-                        pasta_id=st.secrets["id_imagens"], 
-                        pdf=pdf, 
-                        x=x_imagem1+2, 
-                        y=y_imagem1+2, 
-                        largura=largura_imagem-4
-                    )
-
-                    # Observação da primeira OS
-                    pdf.set_xy(10, 95)
-                    
-
-                    # LINHA DIVISÓRIA (GUIA DE CORTE) - ALTERAÇÃO PRINCIPAL
-                    pdf.set_draw_color(0, 0, 0)  # Cor preta
-                    pdf.set_line_width(0.5)  # Espessura da linha
-                    pdf.line(10, 148, 200, 148)  # Linha horizontal no meio da página
-                    
-                    # Texto indicativo de corte
-                    pdf.set_xy(85, 145)
-                    pdf.set_font("Arial", style="I", size=8)
-                    pdf.cell(40, 5, "--- LINHA DE CORTE ---", align=Align.C)
-
-                    # SEGUNDA OS (PARTE INFERIOR) - ALTERAÇÃO PRINCIPAL
-                    pdf.set_font("Arial", size=12)
-                    pdf.set_xy(10, 155)
-                    pdf.cell(130, 8, "ORDEM DE SERVIÇO", ln=True, align=Align.C)
-                    
-                    pdf.set_font("Arial", style="B", size=14)
-                    pdf.cell(130, 8, f"Cliente: {cliente2}", ln=True, border=1)
-
-                    pdf.set_font("Arial", style="", size=12)
-                    pdf.cell(130, 7, f"Equipe: {equipe2}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Estampa: {estampa2}", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Tamanho: {tamanho2}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Quantidade: ", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Data Entrega: {data_entrega2}", ln=True, border=True)
-                    #pdf.cell(95, 8, f"Código: {codigo}", ln=True, border=True)
-
-                    pdf.multi_cell(130, 8, f"Observação: {observacao2}", border=1, ln=True, align=Align.L)
-
-                    # Área para imagem da segunda OS
-                    x_imagem2 = 140
-                    y_imagem2 = 163
-                    pdf.rect(x_imagem2, y_imagem2, largura_imagem, altura_imagem)
-
-                    adicionar_imagem_ao_pdf(
-                        nome_imagem=estampa2.rsplit('.', 1)[0], 
-                        pasta_id=st.secrets["id_imagens"], 
-                        pdf=pdf, 
-                        x=x_imagem2+2, 
-                        y=y_imagem2+2, 
-                        largura=largura_imagem-4
-                    )
-
-                    # Observação da segunda OS
-                    pdf.set_xy(10, 250)
-                    
-
-                    if cliente1 == cliente2:
-                        nome_arquivo = f"OS_{codigo}_{cliente2}.pdf"
-                    else:
-                        nome_arquivo = f"OS_{codigo}_{cliente1}_{cliente2}.pdf"
-
-                    arquivo_salvo = salvar_pdf_no_drive(
-                        pdf=pdf,
-                        nome_arquivo=nome_arquivo,
-                        pasta_id=st.secrets["id_os"]
-                    )
-
-                    if arquivo_salvo:
-                        st.success("PDF salvo com sucesso no Google Drive!")
-
-
-    elif imprimir ==  "Imprimir 3 OS em uma folha":
-        st.markdown("---")
-        estampa1 = st.selectbox("Qual modelo de estampa 1?", nomes_estampas)
-
-        if estampa1:
-            estampa1 = mapeamento_estampas[estampa1]
+        # Só executa quando o botão for clicado
+        if submitted:
+
+            # Reserva os códigos na hora de gravar, sem colidir com outros usuários
+            codigo = reservar_codigos_os(len(ordens))
+
+            # Uma única escrita para todas as OS
+            registrar_os([
+                [str(codigo + i), str(data_carimbo), str(ordem["data_entrega"]), str(ordem["estampa"]),
+                 str(ordem["tamanho"]), str(ordem["cliente"]), str(ordem["equipe"]), str(ordem["observacao"])]
+                for i, ordem in enumerate(ordens)
+            ])
+
+            imagens = imagens_das_ordens(ordens, st.secrets["id_imagens"])
+            pdf, falhas = compor_folhas_os(ordens, modelo, imagens)
+            for erro in dict.fromkeys(erro for _, erro in falhas):
+                st.error(erro)
+
+            clientes = "_".join(dict.fromkeys(ordem["cliente"] for ordem in ordens))
+            arquivo_salvo = salvar_pdf_no_drive(
+                pdf=pdf,
+                nome_arquivo=f"OS_{codigo}_{clientes}.pdf",
+                pasta_id=st.secrets["id_os"],
+                codigos_os=range(codigo, codigo + len(ordens))
+            )
 
+            if arquivo_salvo:
+                st.success("PDF salvo com sucesso no Google Drive!")
+
+
+## Importação de OS em lote ##
+# Quantos PDFs são montados e enviados ao Drive ao mesmo tempo na importação
+UPLOADS_PARALELOS = int(st.secrets.get("uploads_paralelos", 3))
+
+# Nomes de coluna aceitos na planilha de pedidos (sem acento, minúsculos) -> campo da OS
+COLUNAS_IMPORTACAO = {
+    "estampa": "estampa", "modelo": "estampa",
+    "tamanho": "tamanho",
+    "cliente": "cliente",
+    "equipe": "equipe",
+    "entrega": "data_entrega", "data entrega": "data_entrega", "data de entrega": "data_entrega",
+    "data entrega prevista": "data_entrega",
+    "observacao": "observacao", "observacoes": "observacao", "obs": "observacao",
+}
+COLUNAS_OBRIGATORIAS = ["estampa", "tamanho", "cliente", "equipe", "data_entrega"]
+
+def _normalizar_coluna(nome):
+    """Nome de coluna sem acentos, em minúsculas e com espaços simples"""
+    sem_acento = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode()
+    return " ".join(sem_acento.lower().replace("_", " ").split())
+
+def _data_do_pedido(valor):
+    """Data de entrega em dd/mm/aaaa, dd/mm/aa ou no formato que o Excel exporta (aaaa-mm-dd)"""
+    for formato in ("%d/%m/%Y", "%d/%m/%y", "ISO8601"):
+        data = pd.to_datetime(valor, format=formato, errors="coerce")
+        if not pd.isna(data):
+            return data.date()
+    return None
+
+def ler_planilha_pedidos(arquivo):
+    """Lê o CSV ou XLSX enviado, com as colunas renomeadas para os campos da OS"""
+    if arquivo.name.lower().endswith(".xlsx"):
         try:
-            imagem = baixar_imagem_por_nome(estampa1, st.secrets["id_imagens"])
-            if imagem:
-
-                st.image(imagem, caption=estampa1)   
-
-        except:
-            
-            st.warning("modelo não encontrado para visualização")
-
-        st.markdown("---")
-        estampa2 = st.selectbox("Qual modelo de estampa 2?", nomes_estampas)
-
-        if estampa2:
-            estampa2 = mapeamento_estampas[estampa2]
-
+            pedidos = pd.read_excel(arquivo, dtype=str, engine="openpyxl")
+        except (ValueError, zipfile.BadZipFile) as e:
+            st.error(f"Não foi possível ler a planilha .xlsx: {e}")
+            return None
+    else:
+        conteudo = arquivo.getvalue()
         try:
-            imagem = baixar_imagem_por_nome(estampa2, st.secrets["id_imagens"])
-            if imagem:
-
-                st.image(imagem, caption=estampa2)   
-
-        except:
-            
-            st.warning("modelo não encontrado para visualização")
-
-        
-        st.markdown("---")
-        estampa3 = st.selectbox("Qual modelo de estampa 3?", nomes_estampas)
-
-        if estampa3:
-            estampa3 = mapeamento_estampas[estampa3]
+            texto = conteudo.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            # CSV salvo pelo Excel em português vem em Windows-1252
+            try:
+                texto = conteudo.decode("cp1252")
+            except UnicodeDecodeError:
+                st.error("Não foi possível ler o arquivo: salve o CSV em UTF-8 ou no formato padrão do Excel.")
+                return None
 
         try:
-            imagem = baixar_imagem_por_nome(estampa3, st.secrets["id_imagens"])
-            if imagem:
-
-                st.image(imagem, caption=estampa3)   
-
-        except:
-            
-            st.warning("modelo não encontrado para visualização")
-
-        with st.form("AbrirOS"):
-            
-            data_entrega1 = st.date_input("Qual data da entrega prevista pedido 1?", value="today", min_value="today")
-            data_entrega1 = data_entrega1.strftime("%d/%m/%Y")
-
-            tamanho1 = st.radio("Qual tamanho do modelo 1?", tamanhos)
-
-            cliente1 = st.text_input("Qual o nome do cliente 1?", value="")
-
-            equipes_filtradas = list(set([e for e in equipes if e.startswith("ESTAMPARIA")]))
-            equipe1 = st.radio("Qual equipe responsável pelo pedido 1?", equipes_filtradas)
-
-            observacao1 = st.text_input("Observação modelo 1?", max_chars=200)
-
-            st.markdown("---")
-
-            data_entrega2 = st.date_input("Qual data da entrega prevista pedido 2?", value="today", min_value="today")
-            data_entrega2 = data_entrega2.strftime("%d/%m/%Y")
-            
-            #st.markdown("---")
-            #quantidade = st.number_input("Qual quantidade de camisas?", min_value = 1) #Voltar com quantidade?
-
-            tamanho2 = st.radio("Qual tamanho do modelo 2?", tamanhos)
-            
-            cliente2 = st.text_input("Qual o nome do cliente 2?", value=cliente1)
-            
-            equipe2 = st.radio("Qual equipe responsável pelo pedido 2?", equipes_filtradas)
-
-            # if estampa in estampas_bordado:
-            #     bordado = True
-            # else: 
-            #     bordado = False
-            
-            observacao2 = st.text_input("Observação modelo 2?", max_chars=200)
-
-            st.markdown("---")
-
-            data_entrega3 = st.date_input("Qual data da entrega prevista pedido 3?", value="today", min_value="today")
-            data_entrega3 = data_entrega3.strftime("%d/%m/%Y")
-            
-            #st.markdown("---")
-            #quantidade = st.number_input("Qual quantidade de camisas?", min_value = 1) #Voltar com quantidade?
-
-            tamanho3 = st.radio("Qual tamanho do modelo 3?", tamanhos)
-            
-            cliente3 = st.text_input("Qual o nome do cliente 3?", value=cliente1)
-            
-            equipe3 = st.radio("Qual equipe responsável pelo pedido 3?", equipes_filtradas)
-
-            # if estampa in estampas_bordado:
-            #     bordado = True
-            # else: 
-            #     bordado = False
-            
-            observacao3 = st.text_input("Observação modelo 3?", max_chars=200)
-
-            submitted = st.form_submit_button("Criar OS!")
-                
-            # Só executa quando o botão para clicado
-            if submitted:
-
-                # Pega todos os valores da primeira coluna
-                valores = planilhaOS.col_values(1)
+            # Aceita tanto "," quanto ";" (padrão do Excel em português)
+            pedidos = pd.read_csv(io.StringIO(texto), dtype=str, sep=None, engine="python")
+        except (csv.Error, pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+            st.error(f"Não foi possível ler o CSV (ele precisa de cabeçalho e colunas separadas por \",\" ou \";\"): {e}")
+            return None
 
-                # Descobre a primeira linha vazia
-                linha_vazia = len(valores) + 1  # +1 porque col_values não conta a próxima linha vazia
+    pedidos = pedidos.rename(columns=lambda coluna: COLUNAS_IMPORTACAO.get(_normalizar_coluna(coluna), coluna))
+    faltando = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in pedidos]
+    if faltando:
+        st.error(f"Colunas obrigatórias ausentes na planilha: {', '.join(faltando)}")
+        return None
 
-                #cria nova linha
-                nova_linha1 = [[str(codigo), str(data_carimbo), str(data_entrega1), str(estampa1),
-                    #str(bordado), #str(quantidade),
-                    str(tamanho1), str(cliente1), str(equipe1), str(observacao1)]]
-                
-                nova_linha2 = [[str(codigo+1), str(data_carimbo), str(data_entrega2), str(estampa2),
-                    #str(bordado), #str(quantidade),
-                    str(tamanho2), str(cliente2), str(equipe2), str(observacao2)]]
-                
-                nova_linha3 = [[str(codigo+2), str(data_carimbo), str(data_entrega3), str(estampa3),
-                    #str(bordado), #str(quantidade),
-                    str(tamanho3), str(cliente3), str(equipe3), str(observacao3)]]
-
-                planilhaOS.update(f"A{linha_vazia}:K{linha_vazia}", nova_linha1)
-                planilhaOS.update(f"A{linha_vazia+1}:K{linha_vazia+1}", nova_linha2)
-                planilhaOS.update(f"A{linha_vazia+2}:K{linha_vazia+2}", nova_linha3)
-
-                if imprimir:
-                    pdf = FPDF("portrait", "mm", "A4")  # Alterado para portrait para melhor aproveitamento do espaço
-                    pdf.add_page()
-                    pdf.set_font("Arial", size=12)
-
-                    # PRIMEIRA OS (PARTE SUPERIOR)
-                    pdf.cell(130, 8, "ORDEM DE SERVIÇO", ln=True, align=Align.C)
-                    pdf.set_font("Arial", style="B", size=14)
-                    pdf.cell(130, 8, f"Cliente: {cliente1}", ln=True, border=1)
-
-                    pdf.set_font("Arial", style="", size=12)
-                    pdf.cell(130, 7, f"Equipe: {equipe1}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Estampa: {estampa1}", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Tamanho: {tamanho1}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Quantidade: ", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Data Entrega: {data_entrega1}",ln=True, border=True)
-                    #pdf.cell(95, 8, f"Código: {codigo}", ln=True, border=True)
+    if "observacao" not in pedidos:
+        pedidos["observacao"] = ""
+    return pedidos.fillna("").map(str.strip)
 
-                    pdf.multi_cell(130, 7, f"Observação: {observacao1}", border=1, ln=True, align=Align.L)
-                    
-                    # Área para imagem da primeira OS
-                    x_imagem1 = 140
-                    y_imagem1 = 18
-                    largura_imagem = 50
-                    altura_imagem = 75
+def validar_pedidos(pedidos, equipes_validas):
+    """Confere cada pedido; devolve as OS válidas e a situação de todas as linhas da planilha"""
+    estampas_validas = set(mapeamento_estampas.values())
+    hoje = date.today()
 
-                    pdf.rect(x_imagem1, y_imagem1, largura_imagem, altura_imagem)
+    ordens, situacoes = [], []
+    for posicao, pedido in enumerate(pedidos.to_dict("records")):
+        problemas = []
+
+        estampa = mapeamento_estampas.get(pedido["estampa"], pedido["estampa"])
+        if estampa not in estampas_validas:
+            problemas.append("estampa não encontrada")
+        tamanho = pedido["tamanho"].upper()
+        if tamanho not in tamanhos:
+            problemas.append("tamanho inválido")
+        if not pedido["cliente"]:
+            problemas.append("cliente vazio")
+        if pedido["equipe"] not in equipes_validas:
+            problemas.append("equipe inválida")
+        data_entrega = _data_do_pedido(pedido["data_entrega"])
+        if data_entrega is None:
+            problemas.append("data de entrega inválida")
+        elif data_entrega < hoje:
+            problemas.append("data de entrega no passado")
+
+        linha = posicao + 2  # +2 pelo cabeçalho da planilha enviada
+        situacoes.append({
+            "Linha": linha,
+            "Estampa": pedido["estampa"],
+            "Cliente": pedido["cliente"],
+            "Situação": "; ".join(problemas) or "OK",
+        })
+        if not problemas:
+            ordens.append({
+                "linha": linha,
+                "estampa": estampa,
+                "tamanho": tamanho,
+                "cliente": pedido["cliente"],
+                "equipe": pedido["equipe"],
+                "data_entrega": data_entrega.strftime("%d/%m/%Y"),
+                "observacao": pedido["observacao"][:200],
+            })
+
+    return ordens, pd.DataFrame(situacoes)
+
+def importar_ordens(ordens, modelo):
+    """Grava todas as OS de uma vez e gera/envia um PDF por cliente; devolve a situação de cada OS (None se nada foi gravado)"""
+    data_carimbo = date.today().strftime("%d/%m/%Y")
+
+    codigo = reservar_codigos_os(len(ordens))
+    for i, ordem in enumerate(ordens):
+        ordem["codigo"] = codigo + i
 
-                    adicionar_imagem_ao_pdf(estampa1.rsplit('.', 1)[0], st.secrets["id_imagens"], pdf, x_imagem1+2, y_imagem1+2, largura_imagem-4)            
+    try:
+        registrar_os([
+            [str(ordem["codigo"]), data_carimbo, ordem["data_entrega"], ordem["estampa"],
+             ordem["tamanho"], ordem["cliente"], ordem["equipe"], ordem["observacao"]]
+            for ordem in ordens
+        ])
+    except Exception as e:
+        # A escrita pode ter chegado ao Sheets mesmo com erro na resposta: a próxima reserva relê a aba
+        invalidar_aba("OS")
+        ultimo = codigo + len(ordens) - 1
+        if liberar_codigos_os(codigo, len(ordens)):
+            st.error(f"Não foi possível gravar as OS na planilha: {e}. Confira a aba OS antes de importar de novo.")
+        else:
+            st.error(f"Não foi possível gravar as OS na planilha: {e}. Os códigos {codigo} a {ultimo} "
+                     "já tinham sido reservados e ficarão sem uso. Confira a aba OS antes de importar de novo.")
+        return None
 
-                    # LINHA DIVISÓRIA (GUIA DE CORTE) - ALTERAÇÃO PRINCIPAL
-                    pdf.set_draw_color(0, 0, 0)  # Cor preta
-                    pdf.set_line_width(0.5)  # Espessura da linha
-                    pdf.line(10, 98, 200, 98)  # Linha horizontal no meio da página
-                    
-                    # Texto indicativo de corte
-                    pdf.set_xy(85, 95)
-                    pdf.set_font("Arial", style="I", size=8)
-                    pdf.cell(40, 5, "--- LINHA DE CORTE ---", align=Align.C)
-
-                    # SEGUNDA OS
-                    pdf.set_font("Arial", size=12)
-                    pdf.set_xy(10, 105)
-                    pdf.cell(130, 8, "ORDEM DE SERVIÇO", ln=True, align=Align.C)
-                    
-                    pdf.set_font("Arial", style="B", size=14)
-                    pdf.cell(130, 8, f"Cliente: {cliente2}", ln=True, border=1)
+    imagens = imagens_das_ordens(ordens, st.secrets["id_imagens"])
+
+    por_cliente = {}
+    for ordem in ordens:
+        por_cliente.setdefault(ordem["cliente"], []).append(ordem)
+
+    pasta_os = st.secrets["id_os"]
+
+    def montar_e_enviar(cliente, grupo):
+        # Roda em uma thread: as falhas voltam junto com o arquivo para serem mostradas na tela
+        pdf, falhas = compor_folhas_os(grupo, modelo, imagens)
+        arquivo = enviar_pdf_para_drive(bytes(pdf.output()), f"OS_{grupo[0]['codigo']}_{cliente}.pdf", pasta_os,
+                                        [ordem["codigo"] for ordem in grupo])
+        return arquivo, {ordem["codigo"]: erro for ordem, erro in falhas}
+
+    erros_estampa = {}
+    progresso = st.progress(0.0, text="Enviando PDFs para o Drive...")
+    with ThreadPoolExecutor(max_workers=UPLOADS_PARALELOS) as executor:
+        futuros = {executor.submit(montar_e_enviar, cliente, grupo): cliente for cliente, grupo in por_cliente.items()}
+        for concluidos, futuro in enumerate(as_completed(futuros), start=1):
+            cliente = futuros[futuro]
+            falhas = {}
+            try:
+                arquivo, falhas = futuro.result()
+                situacao, link = "OS gravada e PDF enviado", arquivo.get("webViewLink", "")
+            except Exception as e:
+                # A OS já está na planilha; só o PDF precisa ser refeito
+                situacao, link = f"OS gravada, mas o PDF falhou: {e}", ""
+            for ordem in por_cliente[cliente]:
+                ordem["situacao"], ordem["link"] = situacao, link
+                if ordem["codigo"] in falhas:
+                    ordem["situacao"] += f", sem a estampa: {falhas[ordem['codigo']]}"
+            erros_estampa.update(dict.fromkeys(falhas.values()))
+            progresso.progress(concluidos / len(futuros), text=f"PDFs enviados: {concluidos}/{len(futuros)}")
+
+    for erro in erros_estampa:
+        st.error(erro)
+
+    return pd.DataFrame([{
+        "Linha": ordem["linha"],
+        "Código OS": ordem["codigo"],
+        "Cliente": ordem["cliente"],
+        "Estampa": ordem["estampa"],
+        "Situação": ordem["situacao"],
+        "PDF": ordem["link"],
+    } for ordem in ordens])
+
+def importar_os():
+    st.header("Importar OS de uma planilha")
+    st.write("A planilha (.csv ou .xlsx) precisa das colunas ESTAMPA, TAMANHO, CLIENTE, EQUIPE e ENTREGA "
+             "(dd/mm/aaaa). A coluna OBSERVACAO é opcional.")
+
+    arquivo = st.file_uploader("Planilha de pedidos", type=["csv", "xlsx"])
+    if arquivo is None:
+        return
+
+    pedidos = ler_planilha_pedidos(arquivo)
+    if pedidos is None:
+        return
+
+    equipes_filtradas = set(e for e in equipes if e.startswith("ESTAMPARIA"))
+    ordens, situacoes = validar_pedidos(pedidos, equipes_filtradas)
+
+    st.subheader("Conferência dos pedidos")
+    st.dataframe(situacoes, hide_index=True)
+
+    if len(ordens) < len(situacoes):
+        st.warning(f"{len(situacoes) - len(ordens)} pedido(s) com problema não serão importados.")
+    if not ordens:
+        return
+
+    modelo = st.radio("Impressão", list(MODELOS_FOLHA), key="modelo_importacao")
+
+    if st.button(f"Importar {len(ordens)} OS"):
+        resultado = importar_ordens(ordens, modelo)
+        if resultado is None:
+            return
+        st.success(f"{len(resultado)} OS gravadas na planilha.")
+        st.dataframe(resultado, hide_index=True,
+                     column_config={"PDF": st.column_config.LinkColumn("PDF", display_text="Abrir")})
+
+## Datas e períodos ##
+@st.cache_resource(max_entries=8, show_spinner=False)
+def enriquecer_datas(versao, _dados):
+    """Acrescenta DATA_DT (datetime) e PERIODO (Period[M]) uma única vez por versão dos dados"""
+    dados = _dados.copy()
+    dados['DATA_DT'] = pd.to_datetime(dados['DATA'], format='%d/%m/%Y')
+    dados['PERIODO'] = dados['DATA_DT'].dt.to_period('M')
+    return dados
+
+def dados_com_datas(dados):
+    """Versão compartilhada (somente leitura) dos dados com as colunas de data já convertidas"""
+    return enriquecer_datas(versao_dados(dados), dados)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def indice_meses(versao, _dados):
+    """Meses presentes nos dados no formato "M/AAAA", do mais recente para o mais antigo"""
+    periodos = enriquecer_datas(versao, _dados)['PERIODO'].dropna().unique()
+    return [f"{periodo.month}/{periodo.year}" for periodo in sorted(periodos, reverse=True)]
+
+def meses_disponiveis(dados):
+    """Lista de meses usada nos seletores de período das páginas"""
+    return indice_meses(versao_dados(dados), dados)
+
+def periodo_de_texto(periodo):
+    """Converte o período "M/AAAA" da tela em um Period mensal"""
+    mes, ano = periodo.split('/')
+    return pd.Period(year=int(ano), month=int(mes), freq='M')
+
+## Índices para os editores ##
+@st.cache_resource(max_entries=16, show_spinner=False)
+def indice_linhas(versao, _dados, colunas):
+    """Posições das linhas agrupadas pelos valores das colunas, montado uma vez por versão dos dados"""
+    grupos = _dados.groupby(list(colunas), sort=False, dropna=False).indices
+    return {chave if isinstance(chave, tuple) else (chave,): posicoes.tolist() for chave, posicoes in grupos.items()}
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def indice_opcoes(versao, _dados, colunas, coluna_opcao):
+    """Valores distintos de uma coluna para cada chave, na ordem em que aparecem (selectboxes em cascata)"""
+    return {
+        chave: list(dict.fromkeys(_dados[coluna_opcao].iloc[posicoes]))
+        for chave, posicoes in indice_linhas(versao, _dados, colunas).items()
+    }
+
+def opcoes_por_chave(dados, colunas, coluna_opcao, *chave):
+    """Opções de um selectbox filtradas pelos valores escolhidos nos anteriores"""
+    return indice_opcoes(versao_dados(dados), dados, tuple(colunas), coluna_opcao).get(tuple(chave), [])
+
+def linha_para_editar(dados, colunas, *chave):
+    """Posição da linha com a chave informada; pede para escolher quando há lançamentos repetidos"""
+    posicoes = indice_linhas(versao_dados(dados), dados, tuple(colunas)).get(tuple(chave), [])
+    if not posicoes:
+        st.warning("Nenhum lançamento encontrado para os dados informados.")
+        st.stop()
+    if len(posicoes) == 1:
+        return posicoes[0]
+
+    st.warning(f"Existem {len(posicoes)} lançamentos para {' / '.join(map(str, chave))} na planilha.")
+    return st.selectbox("Escolha qual deseja editar:", posicoes, format_func=lambda posicao: f"Linha {posicao + 2}")
+
+## Agregados do dashboard ##
+def chave_periodo(periodo):
+    """Converte o período "M/AAAA" da tela na chave inteira AAAAMM"""
+    mes, ano = periodo.split('/')
+    return int(ano) * 100 + int(mes)
+
+def _sem_categorias(tabela):
+    """Volta as colunas categóricas para texto nas tabelas pequenas que vão para os gráficos"""
+    return tabela.astype({coluna: str for coluna in tabela.select_dtypes("category").columns})
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def cubo_producao(versao, _dados):
+    """Totais de produção por mês × setor × subsetor × dia, calculados uma vez por versão dos dados"""
+    dados = enriquecer_datas(versao, _dados)[['DATA_DT', 'SETOR', 'SUBSETOR', 'TOTAL']].copy()
+    dados['PERIODO'] = dados['DATA_DT'].dt.year * 100 + dados['DATA_DT'].dt.month
+    dados['SETOR'] = dados['SETOR'].astype('category')
+    dados['SUBSETOR'] = dados['SUBSETOR'].astype('category')
+    dados['TOTAL'] = pd.to_numeric(dados['TOTAL'], errors='coerce').fillna(0)
+
+    cubo = dados.groupby(['PERIODO', 'SETOR', 'SUBSETOR', 'DATA_DT'], observed=True)['TOTAL'].sum().reset_index()
+
+    # Setores de cada mês na ordem em que aparecem na planilha
+    setores_por_periodo = dados.drop_duplicates(['PERIODO', 'SETOR']).groupby('PERIODO')['SETOR'].agg(list)
+
+    agregados = {}
+    for periodo, fatia in cubo.groupby('PERIODO'):
+        producao_subsetor = _sem_categorias(
+            fatia.groupby(['SETOR', 'SUBSETOR'], observed=True)['TOTAL'].sum().reset_index()
+        )
+        producao_diaria_setor = _sem_categorias(
+            fatia.groupby(['DATA_DT', 'SETOR'], observed=True)['TOTAL'].sum().reset_index().sort_values('DATA_DT')
+        )
+        setores = [str(setor) for setor in setores_por_periodo[periodo]]
+
+        agregados[periodo] = {
+            "setores": setores,
+            "por_setor": _sem_categorias(fatia.groupby('SETOR', observed=True)['TOTAL'].sum().reset_index()),
+            "diario": producao_diaria_setor,
+            "subsetor_por_setor": {
+                setor: producao_subsetor[producao_subsetor['SETOR'] == setor][['SUBSETOR', 'TOTAL']].reset_index(drop=True)
+                for setor in setores
+            },
+            "diario_por_setor": {
+                setor: producao_diaria_setor[producao_diaria_setor['SETOR'] == setor].reset_index(drop=True)
+                for setor in setores
+            },
+        }
 
-                    pdf.set_font("Arial", style="", size=12)
-                    pdf.cell(130, 7, f"Equipe: {equipe2}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Estampa: {estampa2}", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Tamanho: {tamanho2}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Quantidade: ", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Data Entrega: {data_entrega2}", ln=True, border=True)
-                    #pdf.cell(95, 8, f"Código: {codigo}", ln=True, border=True)
-
-                    pdf.multi_cell(130, 8, f"Observação: {observacao2}", border=1, ln=True, align=Align.L)
-
-                    # Área para imagem da segunda OS
-                    x_imagem2 = 140
-                    y_imagem2 = 103
-                    pdf.rect(x_imagem2, y_imagem2, largura_imagem, altura_imagem)
-
-                    adicionar_imagem_ao_pdf(
-                        nome_imagem=estampa2.rsplit('.', 1)[0], 
-                        pasta_id=st.secrets["id_imagens"], 
-                        pdf=pdf, 
-                        x=x_imagem2+2, 
-                        y=y_imagem2+2, 
-                        largura=largura_imagem-4
-                    )
-                    # LINHA DIVISÓRIA (GUIA DE CORTE) - ALTERAÇÃO PRINCIPAL
-                    pdf.set_draw_color(0, 0, 0)  # Cor preta
-                    pdf.set_line_width(0.5)  # Espessura da linha
-                    pdf.line(10, 188, 200, 188)  # Linha horizontal no meio da página
-                    
-                    # Texto indicativo de corte
-                    pdf.set_xy(85, 185)
-                    pdf.set_font("Arial", style="I", size=8)
-                    pdf.cell(40, 5, "--- LINHA DE CORTE ---", align=Align.C)
-
-                    # TERCEIRA OS
-                    pdf.set_font("Arial", size=12)
-                    pdf.set_xy(10, 195)
-                    pdf.cell(130, 8, "ORDEM DE SERVIÇO", ln=True, align=Align.C)
-                    
-                    pdf.set_font("Arial", style="B", size=14)
-                    pdf.cell(130, 8, f"Cliente: {cliente3}", ln=True, border=1)
+    return agregados
+
+def agregados_do_periodo(periodo, dados=None):
+    """Busca (sem varrer a tabela) os totais de um mês no cubo da versão atual dos dados"""
+    if dados is None:
+        dados = dados_Producao_completo
+    cubo = cubo_producao(versao_dados(dados), dados)
+    vazio = {
+        "setores": [],
+        "por_setor": pd.DataFrame(columns=['SETOR', 'TOTAL']),
+        "diario": pd.DataFrame(columns=['DATA_DT', 'SETOR', 'TOTAL']),
+        "subsetor_por_setor": {},
+        "diario_por_setor": {},
+    }
+    return cubo.get(chave_periodo(periodo), vazio)
+
+## Produção individual ##
+# Cabeçalho da coluna do Quadro que diz se o funcionário continua ativo ("Verdadeiro"/"Falso")
+COLUNA_STATUS_QUADRO = st.secrets.get("coluna_status_quadro", "STATUS")
+
+# Fração do dia perdida por uma falta não abonada, conforme o turno informado no lançamento
+PESOS_TURNO_FALTA = {
+    "Matutino": 0.5,
+    "Vespertino": 0.5,
+    "Dia inteiro": 1.0,
+}
+
+def _faltas_ponderadas(falta):
+    """Fração do dia de ausência (0 a 1) de cada funcionário por data, só com faltas não abonadas"""
+    if not {'NOME', 'DATA', 'ABONIR?'} <= set(falta.columns):
+        return pd.DataFrame(columns=['NOME', 'DATA', 'FALTA'])
+
+    nao_abonadas = falta[falta['ABONIR?'] == "Não"]
+    coluna_turno = next((coluna for coluna in falta.columns if str(coluna).strip().upper() == "TURNO"), None)
+
+    if coluna_turno:
+        # Turno desconhecido conta como o dia inteiro, como era antes
+        pesos = nao_abonadas[coluna_turno].map(PESOS_TURNO_FALTA).fillna(1.0)
+    else:
+        pesos = 1.0
+
+    faltas = nao_abonadas[['NOME', 'DATA']].assign(FALTA=pesos)
+    faltas = faltas.groupby(['NOME', 'DATA'], as_index=False)['FALTA'].sum()
+    faltas['FALTA'] = faltas['FALTA'].clip(upper=1.0)
+    return faltas
+
+def calcular_producao_individual(producao, quadro, falta, periodos, periodo_atual):
+    """Produção individual de todos os funcionários nos meses pedidos, em uma única junção"""
+    periodos = [periodo_de_texto(periodo) for periodo in periodos]
+    periodo_atual = periodo_de_texto(periodo_atual)
+
+    dados_prod = dados_com_datas(producao)
+    dados_prod = dados_prod.loc[dados_prod['PERIODO'].isin(periodos), ['DATA', 'PERIODO', 'SUBSETOR', 'PRODUCAO']].copy()
+    dados_prod['PRODUCAO'] = pd.to_numeric(dados_prod['PRODUCAO'], errors='coerce').fillna(0)
+    # Vários lançamentos do mesmo subsetor no mesmo dia viram um só, senão a presença
+    # de cada funcionário seria somada uma vez por lançamento na divisão abaixo
+    dados_prod = dados_prod.groupby(['SUBSETOR', 'DATA', 'PERIODO'], as_index=False)['PRODUCAO'].sum()
+
+    # Uma linha por funcionário × mês, mesmo sem produção lançada no mês
+    coluna_status = next((coluna for coluna in quadro.columns
+                          if str(coluna).strip().upper() == COLUNA_STATUS_QUADRO.upper()), None)
+    if coluna_status:
+        inativo = quadro[coluna_status].astype(str).str.strip().str.upper().isin(['FALSO', 'FALSE'])
+    else:
+        inativo = False
+    equipe = quadro[['NOME', 'SETOR', 'SUBSETOR']].assign(INATIVO=inativo).drop_duplicates(['NOME', 'SETOR', 'SUBSETOR'])
+    grade = equipe.merge(pd.DataFrame({'PERIODO': pd.PeriodIndex(periodos, freq='M')}), how='cross')
+    # O Quadro não guarda a data de saída: quem está inativo sai só da divisão do mês corrente,
+    # e os meses passados continuam com a equipe que trabalhou neles
+    grade = grade[~(grade['INATIVO'] & (grade['PERIODO'] >= periodo_atual))].drop(columns='INATIVO')
+
+    # Uma linha por funcionário × dia lançado para o subsetor dele
+    linhas = grade.merge(dados_prod, on=['SUBSETOR', 'PERIODO'], how='left')
+    linhas['PRODUCAO'] = linhas['PRODUCAO'].fillna(0)
+
+    # Presença ponderada pelo turno: meio período de falta vale meio dia
+    linhas = linhas.merge(_faltas_ponderadas(falta), on=['NOME', 'DATA'], how='left')
+    linhas['FALTA'] = pd.to_numeric(linhas['FALTA']).fillna(0)
+    linhas['PRESENCA'] = 1 - linhas['FALTA']
+    linhas['PRODUCAO_INDIVIDUAL'] = linhas['PRODUCAO'] * linhas['PRESENCA']
+
+    # Divide a produção do dia entre os presentes, na proporção da presença de cada um
+    presenca_equipe = linhas.groupby(['SUBSETOR', 'DATA'])['PRESENCA'].transform('sum')
+    linhas['COTA_INDIVIDUAL'] = (linhas['PRODUCAO_INDIVIDUAL'] / presenca_equipe.where(presenca_equipe > 0)).fillna(0)
+
+    tabela = linhas.groupby(['PERIODO', 'SETOR', 'SUBSETOR', 'NOME'], as_index=False).agg(
+        PRODUCAO_INDIVIDUAL=('PRODUCAO_INDIVIDUAL', 'sum'),
+        COTA_INDIVIDUAL=('COTA_INDIVIDUAL', 'sum'),
+        PRODUCAO_EQUIPE=('PRODUCAO', 'sum'),
+        FALTAS=('FALTA', 'sum'),
+    )
+    tabela['PERIODO'] = tabela['PERIODO'].astype(str)
+    tabela['COTA_INDIVIDUAL'] = tabela['COTA_INDIVIDUAL'].round(2)
+    return tabela
+
+def formatar_quantidade(valor):
+    """Mostra quantidades inteiras sem casas decimais"""
+    return f"{valor:.0f}" if float(valor).is_integer() else f"{valor:.1f}"
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def producao_individual(versoes, periodos, periodo_atual, _producao, _quadro, _falta):
+    """Cache da produção individual por versão das três abas, meses escolhidos e mês corrente"""
+    return calcular_producao_individual(_producao, _quadro, _falta, periodos, periodo_atual)
+
+def tabela_producao_individual(periodos):
+    """Produção individual de todos os funcionários para os meses "M/AAAA" informados"""
+    versoes = tuple(versao_dados(dados) for dados in (dados_Producao_completo, dados_Quadro_completo, dados_Falta_completo))
+    hoje = date.today()
+    return producao_individual(
+        versoes, tuple(periodos), f"{hoje.month}/{hoje.year}",
+        dados_Producao_completo, dados_Quadro_completo, dados_Falta_completo
+    )
 
-                    pdf.set_font("Arial", style="", size=12)
-                    pdf.cell(130, 7, f"Equipe: {equipe3}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Estampa: {estampa3}", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Tamanho: {tamanho3}", ln=True, border=True)
-                    pdf.cell(130, 7, f"Quantidade: ", ln=True, border=True)
-                    
-                    pdf.cell(130, 7, f"Data Entrega: {data_entrega3}", ln=True, border=True)
-                    #pdf.cell(95, 8, f"Código: {codigo}", ln=True, border=True)
-
-                    pdf.multi_cell(130, 8, f"Observação: {observacao3}", border=1, ln=True, align=Align.L)
-
-                    # Área para imagem da segunda OS
-                    x_imagem3 = 140
-                    y_imagem3 = 203
-                    pdf.rect(x_imagem3, y_imagem3, largura_imagem, altura_imagem)
-
-                    adicionar_imagem_ao_pdf(
-                        nome_imagem=estampa3.rsplit('.', 1)[0], 
-                        pasta_id=st.secrets["id_imagens"], 
-                        pdf=pdf, 
-                        x=x_imagem3+2, 
-                        y=y_imagem3+2, 
-                        largura=largura_imagem-4
-                    )
+## Figuras do dashboard ##
+# Quantidade máxima de figuras prontas guardadas em memória (as menos usadas saem primeiro)
+TAMANHO_CACHE_FIGURAS = int(st.secrets.get("tamanho_cache_figuras", 256))
 
-                    if cliente1 == cliente2 == cliente3:
-                        nome_arquivo = f"OS_{codigo}_{cliente1}.pdf"
-                    elif cliente1 == cliente2:
-                        nome_arquivo = f"OS_{codigo}_{cliente1}_{cliente3}.pdf"
-                    elif cliente2 == cliente3:
-                        nome_arquivo = f"OS_{codigo}_{cliente1}_{cliente2}.pdf"
-                    elif cliente1 == cliente3:
-                        nome_arquivo = f"OS_{codigo}_{cliente1}_{cliente2}.pdf"
-                    else:
-                        nome_arquivo = f"OS_{codigo}_{cliente1}_{cliente2}_{cliente3}.pdf"
+# Segundos que cada setor fica na tela no modo apresentação
+INTERVALO_APRESENTACAO = int(st.secrets.get("intervalo_apresentacao", 15))
 
-                    arquivo_salvo = salvar_pdf_no_drive(
-                        pdf=pdf,
-                        nome_arquivo=nome_arquivo,
-                        pasta_id=st.secrets["id_os"]
-                    )
+def _figura_pizza(agregados, periodo, setor):
+    return px.pie(
+        agregados["por_setor"],
+        names='SETOR',
+        values='TOTAL',
+        title=f"Distribuição da Produção - Mês {periodo}",
+        hole=0.4
+    )
 
-                    if arquivo_salvo:
-                        st.success("PDF salvo com sucesso no Google Drive!")
+def _figura_barra(agregados, periodo, setor):
+    return px.bar(
+        agregados["subsetor_por_setor"][setor],
+        y='TOTAL',
+        x='SUBSETOR',
+        title=f"Distribuição por Subsetor - {setor}",
+        color="SUBSETOR",
+        color_discrete_sequence=px.colors.qualitative.Bold
+    )
 
+def _figura_linha(agregados, periodo, setor):
+    # Cada setor mantém sua cor pela posição dele no mês
+    i = agregados["setores"].index(setor)
+    fig_linha = px.line(
+        agregados["diario_por_setor"][setor],
+        x='DATA_DT',
+        y='TOTAL',
+        title=f"Produção - {setor}",
+        markers = True,
+        labels={"TOTAL": "Unidades Produzidas", "DATA_DT": "Data"},
+        color_discrete_sequence=[px.colors.qualitative.G10[i % len(px.colors.qualitative.G10)]]
+    )
+    fig_linha.update_layout(xaxis_tickformat='%d/%m')
+    return fig_linha
+
+def _figura_pizza_apresentacao(agregados, periodo, setor):
+    fig_pizza = _figura_pizza(agregados, periodo, setor)
+    fig_pizza.update_layout(
+        height=320,  # Altura compacta
+        margin=dict(l=10, r=10, t=30, b=10),
+        title_x=0.5,
+        showlegend=True,  # Controlar se mostra legenda
+        legend=dict(
+            orientation="h",  # Legenda horizontal ocupa menos espaço vertical
+            yanchor="bottom",
+            y=-0.1,
+            xanchor="center",
+            x=0.5
+        )
+    )
+    return fig_pizza
+
+def _figura_barra_apresentacao(agregados, periodo, setor):
+    fig_barra = _figura_barra(agregados, periodo, setor)
+    fig_barra.update_layout(height=530)
+    return fig_barra
+
+# Tipos de gráfico que a fábrica de figuras sabe montar
+CONSTRUTORES_FIGURA = {
+    "pizza": _figura_pizza,
+    "barra": _figura_barra,
+    "linha": _figura_linha,
+    "pizza_apresentacao": _figura_pizza_apresentacao,
+    "barra_apresentacao": _figura_barra_apresentacao,
+}
+
+@st.cache_resource
+def cache_figuras():
+    """Cache LRU de figuras prontas, compartilhado entre as sessões"""
+    return {"lock": threading.Lock(), "figuras": LRUCache(maxsize=TAMANHO_CACHE_FIGURAS)}
+
+def obter_figura(dados, periodo, tipo, setor=None):
+    """Devolve a figura do Plotly de um gráfico, montando só na primeira vez por versão e mês"""
+    chave = (versao_dados(dados), periodo, tipo, setor)
+    cache = cache_figuras()
+
+    with cache["lock"]:
+        figura = cache["figuras"].get(chave)
+
+    if figura is None:
+        agregados = agregados_do_periodo(periodo, dados)
+        figura = CONSTRUTORES_FIGURA[tipo](agregados, periodo, setor)
+        with cache["lock"]:
+            cache["figuras"][chave] = figura
+
+    # A mesma Figure é entregue a todas as sessões: st.plotly_chart só a lê (to_dict faz uma cópia),
+    # sem revalidar o gráfico a partir de um dict a cada rerun
+    return figura
 
 # Gerar dados fictícios de produção para o último mês
 def gerar_dados_producao(periodo):
     if st.session_state['rotation'] == "a":
     
-        dados_periodo = dados_Producao_completo.copy()
-        dados_periodo['DATA_DT'] = pd.to_datetime(dados_periodo['DATA'], format='%d/%m/%Y')
-        dados_periodo['MES'] = dados_periodo['DATA_DT'].dt.month
-        dados_periodo['ANO'] = dados_periodo['DATA_DT'].dt.year
-        dados_periodo['MES_ANO'] = dados_periodo['MES'].astype(str) + '/' + dados_periodo['ANO'].astype(str)
-        dados_filtrados = dados_periodo[dados_periodo['MES_ANO'] == periodo]
-        
-        # Dados agrupados
-        producao_por_setor = dados_filtrados.groupby('SETOR')['TOTAL'].sum().reset_index()
-        producao_diaria_setor = dados_filtrados.groupby(['DATA_DT', 'SETOR'])['TOTAL'].sum().reset_index().sort_values('DATA_DT')
+        setores = agregados_do_periodo(periodo)["setores"]
 
         st.subheader(f"Produção por Setor - Mês {periodo}") 
 
-        fig_pizza = px.pie(
-            producao_por_setor,
-            names='SETOR',
-            values='TOTAL',
-            title=f"Distribuição da Produção - Mês {periodo}",
-            hole=0.4
-        )
-        st.plotly_chart(fig_pizza, use_container_width=True)
+        st.plotly_chart(obter_figura(dados_Producao_completo, periodo, "pizza"), use_container_width=True)
 
         st.subheader(f"Distribuição por Subsetor - Mês {periodo}")
 
-        for setor in dados_filtrados['SETOR'].unique():
-            dados_setor = dados_filtrados[dados_filtrados['SETOR'] == setor]
-            producao_subsetor = dados_setor.groupby('SUBSETOR')['TOTAL'].sum().reset_index()
-            
-            fig_bar = px.bar(
-                producao_subsetor,
-                y='TOTAL',
-                x='SUBSETOR',
-                title=f"Distribuição por Subsetor - {setor}",
-                color="SUBSETOR",
-                color_discrete_sequence=px.colors.qualitative.Bold
-            )
-            st.plotly_chart(fig_bar, use_container_width=True)
-
-        i = 0
+        for setor in setores:
+            st.plotly_chart(obter_figura(dados_Producao_completo, periodo, "barra", setor), use_container_width=True)
 
         st.subheader(f"Distribuição por Setor ao longo do tempo- Mês {periodo}")
 
-        for setor in dados_filtrados['SETOR'].unique():
-            dados_setor = producao_diaria_setor[producao_diaria_setor['SETOR'] == setor]
-
-            fig_linha = px.line(
-                dados_setor,
-                x='DATA_DT',
-                y='TOTAL',
-                title=f"Produção - {setor}",
-                markers = True,
-                labels={"TOTAL": "Unidades Produzidas", "DATA_DT": "Data"},
-                color_discrete_sequence=[px.colors.qualitative.G10[i % len(px.colors.qualitative.G10)]]
-            )
-            fig_linha.update_layout(xaxis_tickformat='%d/%m')
-            st.plotly_chart(fig_linha, use_container_width=True)
-            i+=1
+        for setor in setores:
+            st.plotly_chart(obter_figura(dados_Producao_completo, periodo, "linha", setor), use_container_width=True)
 
-        
-    
     else:
-        dados_periodo = dados_Producao_completo.copy()
-        dados_periodo['DATA_DT'] = pd.to_datetime(dados_periodo['DATA'], format='%d/%m/%Y')
-        dados_periodo['MES'] = dados_periodo['DATA_DT'].dt.month
-        dados_periodo['ANO'] = dados_periodo['DATA_DT'].dt.year
-        dados_periodo['MES_ANO'] = dados_periodo['MES'].astype(str) + '/' + dados_periodo['ANO'].astype(str)
-        dados_filtrados = dados_periodo[dados_periodo['MES_ANO'] == periodo]
-        
-        # Dados agrupados
-        producao_por_setor = dados_filtrados.groupby('SETOR')['TOTAL'].sum().reset_index()
-        producao_diaria_setor = dados_filtrados.groupby(['DATA_DT', 'SETOR'])['TOTAL'].sum().reset_index().sort_values('DATA_DT')
-
-        @st.fragment
+        # Atualiza sozinho a cada INTERVALO_APRESENTACAO segundos, sem prender a thread do servidor
+        @st.fragment(run_every=INTERVALO_APRESENTACAO)
         def rotacion():
-            delay = 15
-            repeticao = 500
-            texto_placeholder1 = st.empty()
-            texto_placeholder2 = st.empty()
-
-            # Atualiza o display
-            with texto_placeholder1.container():
-                fig_pizza = px.pie(
-                    producao_por_setor,
-                    names='SETOR',
-                    values='TOTAL',
-                    title=f"Distribuição da Produção - Mês {periodo}",
-                    hole=0.4,
-                    height=320  # Altura compacta
-                )
-                
-                fig_pizza.update_layout(
-                    margin=dict(l=10, r=10, t=30, b=10),
-                    title_x=0.5,
-                    showlegend=True,  # Controlar se mostra legenda
-                    legend=dict(
-                        orientation="h",  # Legenda horizontal ocupa menos espaço vertical
-                        yanchor="bottom",
-                        y=-0.1,
-                        xanchor="center",
-                        x=0.5
-                    )
-                )
-                
-                st.plotly_chart(fig_pizza, use_container_width=True)
+            # Relê a Produção a cada troca para mostrar lançamentos novos quando o cache expirar
+            dados = carregar_aba("Producao")
+            setores = agregados_do_periodo(periodo, dados)["setores"]
 
-            for k in range(repeticao):
-                #Dados no tempo (por dia)
-            #     i = 0
-            #     for setor in dados_filtrados['SETOR'].unique():
-    
-            #         with texto_placeholder2.container():
-            #             dados_setor = producao_diaria_setor[producao_diaria_setor['SETOR'] == setor]
-
-            #             fig_linha = px.line(
-            #                 dados_setor,
-            #                 x='DATA_DT',
-            #                 y='TOTAL',
-            #                 title=f"Produção - {setor}",
-            #                 markers = True,
-            #                 labels={"TOTAL": "Unidades Produzidas", "DATA_DT": "Data"},
-            #                 color_discrete_sequence=[px.colors.qualitative.G10[i % len(px.colors.qualitative.G10)]],
-            #                 height=530
-            #             )
-            #             fig_linha.update_layout(xaxis_tickformat='%d/%m')
-            #             st.plotly_chart(fig_linha, use_container_width=True, key=f"chart_{k}.{i}.a")
-            #             i += 1
-
-                                    
-            #         for j in range(delay):
-                
-            #             time.sleep(1)   
+            st.plotly_chart(obter_figura(dados, periodo, "pizza_apresentacao"), use_container_width=True)
 
-                i = 0
-                for setor in dados_filtrados['SETOR'].unique():
-                    
-                    with texto_placeholder2.container():
-                        dados_setor = dados_filtrados[dados_filtrados['SETOR'] == setor]
-                        producao_subsetor = dados_setor.groupby('SUBSETOR')['TOTAL'].sum().reset_index()
-                        
-                        fig_pizza = px.bar(
-                            producao_subsetor,
-                            y='TOTAL',
-                            x='SUBSETOR',
-                            title=f"Distribuição por Subsetor - {setor}",
-                            color="SUBSETOR",
-                            color_discrete_sequence=px.colors.qualitative.Bold,
-                            height= 530
-                        )
-                        st.plotly_chart(fig_pizza, use_container_width=True, key=f"chart_{k}.{i}.b")
-                        i += 1
-
-                    for j in range(delay):
-                
-                        time.sleep(1)
-            
-            with texto_placeholder2.container():
-                st.warning("Resete o código!")
+            if setores:
+                indice = st.session_state.get('indice_apresentacao', 0) % len(setores)
+                st.plotly_chart(obter_figura(dados, periodo, "barra_apresentacao", setores[indice]), use_container_width=True)
+                st.session_state['indice_apresentacao'] = indice + 1
 
         rotacion()
         
@@ -1060,15 +2288,7 @@ if pagina == "Home":
     if st.session_state.modo_apresentacao:
 
         st.session_state['rotation'] = "b"
-        dados_periodo = dados_Producao_completo.copy()
-        dados_periodo['DATA_DT'] = pd.to_datetime(dados_periodo['DATA'], format='%d/%m/%Y')
-        dados_periodo['MES'] = dados_periodo['DATA_DT'].dt.month
-        dados_periodo['ANO'] = dados_periodo['DATA_DT'].dt.year
-        meses_anos = dados_periodo.groupby(['MES', 'ANO']).size().reset_index()
-        meses_anos['MES_ANO'] = meses_anos['MES'].astype(str) + '/' + meses_anos['ANO'].astype(str)
-        meses_anos = meses_anos.sort_values(['ANO', 'MES'], ascending=[False, False])
-
-        meses = meses_anos['MES_ANO'].unique().tolist()
+        meses = meses_disponiveis(dados_Producao_completo)
         col1, col2, col3 = st.columns([4, 2, 1])
 
         with col1:
@@ -1243,15 +2463,7 @@ if pagina == "Home":
 
     st.session_state['rotation'] = "a"
     
-    dados_periodo = dados_Producao_completo.copy()
-    dados_periodo['DATA_DT'] = pd.to_datetime(dados_periodo['DATA'], format='%d/%m/%Y')
-    dados_periodo['MES'] = dados_periodo['DATA_DT'].dt.month
-    dados_periodo['ANO'] = dados_periodo['DATA_DT'].dt.year
-    meses_anos = dados_periodo.groupby(['MES', 'ANO']).size().reset_index()
-    meses_anos['MES_ANO'] = meses_anos['MES'].astype(str) + '/' + meses_anos['ANO'].astype(str)
-    meses_anos = meses_anos.sort_values(['ANO', 'MES'], ascending=[False, False])
-
-    meses = meses_anos['MES_ANO'].unique().tolist()
+    meses = meses_disponiveis(dados_Producao_completo)
     
     periodo_selecionado = st.sidebar.selectbox("Mês", meses)
 
@@ -1262,7 +2474,8 @@ if pagina ==  "Produção":
 
     st.sidebar.write("- - -")
 
-    qp = st.sidebar.radio("Escolha:", ["Lançar Produção", "Editar Informações", "Produção Individual"])
+    qp = st.sidebar.radio("Escolha:", ["Lançar Produção", "Editar Informações", "Produção Individual", "Produção de Todos"])
+    mostrar_fila("Producao")
 
     if qp == "Lançar Produção":
 
@@ -1272,7 +2485,7 @@ if pagina ==  "Produção":
         with st.form("Lançamento Produção"):
             proddata = st.date_input("Data do lançamento", format="DD/MM/YYYY")
 
-            subsetores_filtrados = dados_Quadro_completo[dados_Quadro_completo["SETOR"] == setorProducao]["SUBSETOR"].unique()
+            subsetores_filtrados = opcoes_por_chave(dados_Quadro_completo, ["SETOR"], "SUBSETOR", setorProducao)
 
             subsetorProducao = st.selectbox(
                 "Informe o subsetor do lançamento:", 
@@ -1309,31 +2522,23 @@ if pagina ==  "Produção":
 
                 st.toast(f"{valores_linha}")
 
-                if dados_Producao_completo is not None and len(dados_Producao_completo) > 0:
-                    ultima_linha = dados_Producao_completo.index[-1] + 3
-                else:
-                    ultima_linha = 2  # primeira linha de dados
-            
-                planilhaProducao.batch_update([{
-                            'range': f'A{ultima_linha}:H{ultima_linha}',
-                            'values': [valores_linha]
-                        }])
+                enfileirar_escrita("Producao", valores_linha)
                 
-                st.toast("Submissão feita com sucesso", icon=":material/thumb_up:")
+                st.toast("Submissão registrada, enviando para a planilha", icon=":material/thumb_up:")
 
     elif qp == "Editar Informações":
 
         dataProd = st.selectbox("Informe a data lançada:", dados_Producao_completo["DATA"].unique())
-        setorProd = st.selectbox("Selecione o setor:", dados_Producao_completo[dados_Producao_completo["DATA"] == dataProd]["SETOR"].unique())
-        subsetores_filtrados = dados_Quadro_completo[dados_Quadro_completo["SETOR"] == setorProd]["SUBSETOR"].unique()
+        setorProd = st.selectbox("Selecione o setor:", opcoes_por_chave(dados_Producao_completo, ["DATA"], "SETOR", dataProd))
+        subsetores_filtrados = opcoes_por_chave(dados_Quadro_completo, ["SETOR"], "SUBSETOR", setorProd)
 
         subsetorProducao = st.selectbox(
             "Informe o subsetor do lançamento:", 
             subsetores_filtrados
         )
         
-        indiceEdicao = dados_Producao_completo.index[(dados_Producao_completo['DATA'] == dataProd) & (dados_Producao_completo['SUBSETOR'] == subsetorProducao)].tolist()
-        linhaEdicao = indiceEdicao[0] + 2
+        indiceEdicao = linha_para_editar(dados_Producao_completo, ["DATA", "SUBSETOR"], dataProd, subsetorProducao)
+        linhaEdicao = indiceEdicao + 2
 
         with st.form("Editar Info"):            
 
@@ -1341,14 +2546,14 @@ if pagina ==  "Produção":
             editdata = st.date_input("Alteração na data lançada?", format="DD/MM/YYYY", value= data_datetime)
             editdata = editdata.strftime("%d/%m/%Y")  # Formato DD/MM/YYYY
             
-            producaoAnterior = dados_Producao_completo.iloc[indiceEdicao[0]]['PRODUCAO']
+            producaoAnterior = dados_Producao_completo.iloc[indiceEdicao]['PRODUCAO']
             producaoSetor = st.number_input("Alteração na quantidade produzida?",step=1,value=producaoAnterior)
             horaextra = st.radio("Hora extra?", ["Não", "Sim"])
 
-            producaoHEAnterior = dados_Producao_completo.iloc[indiceEdicao[0]]['PRODUCAO HORA EXTRA']
+            producaoHEAnterior = dados_Producao_completo.iloc[indiceEdicao]['PRODUCAO HORA EXTRA']
             producaoHESetor = st.number_input("Alteração na quantidade produzida em hora extra?",step=1,value=producaoHEAnterior)
             total = producaoSetor + producaoHESetor
-            observacaoanterior = dados_Producao_completo.iloc[indiceEdicao[0]]['OBSERVACOES']
+            observacaoanterior = dados_Producao_completo.iloc[indiceEdicao]['OBSERVACOES']
             observacao = st.text_input("Alteração nas observações?", max_chars=50, value=observacaoanterior)
 
             valores_linha = [
@@ -1368,61 +2573,58 @@ if pagina ==  "Produção":
 
                 st.toast(f"{valores_linha}")
             
-                planilhaProducao.batch_update([{
-                            'range': f'A{linhaEdicao}:H{linhaEdicao}',
-                            'values': [valores_linha]
-                        }])
+                enfileirar_escrita("Producao", valores_linha, intervalo=f'A{linhaEdicao}:H{linhaEdicao}',
+                                   recarga_completa=True)
                 
-                st.toast("Submissão feita com sucesso", icon=":material/thumb_up:")
+                st.toast("Submissão registrada, enviando para a planilha", icon=":material/thumb_up:")
     
     if qp == "Produção Individual":
         setorInd = st.selectbox("Informe o setor do funcionário:", dados_Quadro_completo["SETOR"].unique())
-        subsetorInd = st.selectbox("Informe o subsetor do funcionário:", dados_Quadro_completo[dados_Quadro_completo["SETOR"] == setorInd]["SUBSETOR"].unique())
-        dados_periodo = dados_Producao_completo.copy()
-        dados_periodo['DATA_DT'] = pd.to_datetime(dados_periodo['DATA'], format='%d/%m/%Y')
-        dados_periodo['MES'] = dados_periodo['DATA_DT'].dt.month
-        dados_periodo['ANO'] = dados_periodo['DATA_DT'].dt.year
-        meses_anos = dados_periodo.groupby(['MES', 'ANO']).size().reset_index()
-        meses_anos['MES_ANO'] = meses_anos['MES'].astype(str) + '/' + meses_anos['ANO'].astype(str)
-        dados_periodo['MES_ANO'] = dados_periodo['MES'].astype(str) + '/' + dados_periodo['ANO'].astype(str)
-        meses_anos = meses_anos.sort_values(['ANO', 'MES'], ascending=[False, False])
-
-        meses = meses_anos['MES_ANO'].unique().tolist()
-
-        nomeInd = st.selectbox("Selecione o funcionário:", dados_Quadro_completo[dados_Quadro_completo["SUBSETOR"] == subsetorInd]["NOME"].unique())
+        subsetorInd = st.selectbox("Informe o subsetor do funcionário:", opcoes_por_chave(dados_Quadro_completo, ["SETOR"], "SUBSETOR", setorInd))
+        meses = meses_disponiveis(dados_Producao_completo)
+
+        nomeInd = st.selectbox("Selecione o funcionário:", opcoes_por_chave(dados_Quadro_completo, ["SUBSETOR"], "NOME", subsetorInd))
         
         periodo_selecionado = st.selectbox("Mês", meses)
 
-        if nomeInd in dados_Falta_completo["NOME"].values:
-            
-            filtro = dados_periodo[dados_periodo["MES_ANO"] == periodo_selecionado]
-            filtro = filtro[filtro["SUBSETOR"] == subsetorInd]
-            
-            filtrofalta = filtrofalta = dados_Falta_completo[
-                (dados_Falta_completo["NOME"] == nomeInd) & 
-                (dados_Falta_completo["ABONIR?"] == "Não")
-            ]
-            datas_falta = filtrofalta['DATA'].unique()
-            produção_valida = filtro[~filtro['DATA'].isin(datas_falta)]
+        tabela = tabela_producao_individual([periodo_selecionado])
+        linha = tabela[(tabela["NOME"] == nomeInd) & (tabela["SUBSETOR"] == subsetorInd)]
 
-            somaInd = produção_valida['PRODUCAO'].sum()
+        somaInd = linha["PRODUCAO_INDIVIDUAL"].sum()
+        cotaInd = linha["COTA_INDIVIDUAL"].sum()
+        somaequipe = linha["PRODUCAO_EQUIPE"].sum()
 
-            somaequipe = filtro["PRODUCAO"].sum()
-            
-            st.write("- - -")
-            st.header(f"Produção {nomeInd}:  {somaInd}")
-            st.subheader(f"A produção da equipe: {somaequipe}.")
+        st.write("- - -")
+        st.header(f"Produção {nomeInd}:  {formatar_quantidade(somaInd)}")
+        st.subheader(f"A produção da equipe: {formatar_quantidade(somaequipe)}.")
+        st.write(f"Parte de {nomeInd} na divisão da produção entre os presentes: {formatar_quantidade(cotaInd)}")
 
-        else:
-            filtro = dados_periodo[dados_periodo["MES_ANO"] == periodo_selecionado]
-            filtro = filtro[filtro["SUBSETOR"] == subsetorInd]
+    if qp == "Produção de Todos":
+        meses = meses_disponiveis(dados_Producao_completo)
+        periodos_selecionados = st.multiselect("Meses", meses, default=meses[:1])
 
-            somaequipe = filtro["PRODUCAO"].sum()
+        tabela = tabela_producao_individual(periodos_selecionados)
 
-            
-            st.write("- - -")
-            st.header(f"Produção {nomeInd}:  {somaequipe}")
-            st.subheader(f"A produção da equipe: {somaequipe}.")
+        st.subheader("Produção individual de todos os funcionários")
+        st.dataframe(tabela, use_container_width=True, hide_index=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "Baixar CSV",
+                tabela.to_csv(index=False).encode("utf-8-sig"),
+                file_name="producao_individual.csv",
+                mime="text/csv"
+            )
+        with col2:
+            arquivo_parquet = io.BytesIO()
+            tabela.to_parquet(arquivo_parquet, index=False)
+            st.download_button(
+                "Baixar Parquet",
+                arquivo_parquet.getvalue(),
+                file_name="producao_individual.parquet",
+                mime="application/octet-stream"
+            )
 
 
 if pagina ==  "Estampas":
@@ -1439,7 +2641,7 @@ if pagina ==  "Estampas":
     if visual:
         visual = mapeamento_estampas[visual]
 
-    imagem = baixar_imagem_por_nome(visual, st.secrets["id_imagens"])
+    imagem = baixar_rendicao_por_nome(visual, st.secrets["id_imagens"])
     if imagem:
 
         st.image(imagem, caption=visual)
@@ -1453,9 +2655,10 @@ if pagina == "Fechar Ordem de Serviço":
         if st.button("Fechar Ordem!"):
             if indice:
                 primeira_linha = indice[0]+2  # pega o primeiro índice encontrado
-                valor_atual = planilhaOS.cell(primeira_linha, 4).value
+                valor_atual = obter_aba("OS").cell(primeira_linha, 4).value
                 if valor_atual == "Aberto":
-                    planilhaOS.update_cell(primeira_linha, 4, "Fechado")
+                    obter_aba("OS").update_cell(primeira_linha, 4, "Fechado")
+                    invalidar_aba("OS")
                     st.toast(f"Código '{codigo_procurado}' fechado com sucesso!")
                     st.write("Dê reload na página para visualização")
                 else:
@@ -1479,22 +2682,25 @@ if pagina == "Ver ordens de Serviço":
     mostrar_planilha(dados_os_completo)
 
 if pagina == "Ordem de Serviço":
-    create()
+    st.sidebar.write("- - -")
+
+    qo = st.sidebar.radio("Escolha:", ["Preencher OS", "Importar planilha"])
+    mostrar_envios_pendentes()
+    if qo == "Preencher OS":
+        create()
+    else:
+        importar_os()
 
 if pagina == "Quadro de Funcionários":
     st.sidebar.write("- - -")
 
     qf = st.sidebar.radio("Escolha:", ["Visualizar Quadro", "Adicionar novo funcionário", "Editar Informações"])
+    mostrar_fila("Quadro")
     if qf == "Visualizar Quadro":
         st.subheader("Quadro de funcionários")
         st.dataframe(dados_Quadro_completo)
 
     elif qf == "Adicionar novo funcionário":
-        if dados_Quadro_completo is not None and len(dados_Quadro_completo) > 0:
-            ultima_linha = dados_Quadro_completo.index[-1] + 3
-        else:
-            ultima_linha = 2  # primeira linha de dados
-
         with st.form("Novo funcionário"):
 
             nomeFuncionario = st.text_input("Nome do novo funcionário")
@@ -1516,21 +2722,18 @@ if pagina == "Quadro de Funcionários":
             if submitted:
                 st.toast(f"{valores_linha}")
             
-                planilhaQuadro.batch_update([{
-                            'range': f'A{ultima_linha}:E{ultima_linha}',
-                            'values': [valores_linha]
-                        }])
+                enfileirar_escrita("Quadro", valores_linha)
                 
-                st.toast("Submissão feita com sucesso", icon=":material/thumb_up:")
+                st.toast("Submissão registrada, enviando para a planilha", icon=":material/thumb_up:")
                 
     elif qf == "Editar Informações":
         
 
         setorInfo = st.selectbox("Informe o setor desse funcionário:", dados_Quadro_completo["SETOR"].unique())
-        nomeInfo = st.selectbox("Selecione o nome:", dados_Quadro_completo[dados_Quadro_completo["SETOR"] == setorInfo])
+        nomeInfo = st.selectbox("Selecione o nome:", opcoes_por_chave(dados_Quadro_completo, ["SETOR"], "NOME", setorInfo))
 
-        indiceEdicao = dados_Quadro_completo.index[dados_Quadro_completo['NOME'] == nomeInfo].tolist()
-        linhaEdicao = indiceEdicao[0] + 2
+        indiceEdicao = linha_para_editar(dados_Quadro_completo, ["NOME"], nomeInfo)
+        linhaEdicao = indiceEdicao + 2
 
         with st.form("Edit funcionário"):
 
@@ -1553,12 +2756,9 @@ if pagina == "Quadro de Funcionários":
 
                 st.toast(f"{valores_linha}")
             
-                planilhaQuadro.batch_update([{
-                            'range': f'A{linhaEdicao}:E{linhaEdicao}',
-                            'values': [valores_linha]
-                        }])
+                enfileirar_escrita("Quadro", valores_linha, intervalo=f'A{linhaEdicao}:E{linhaEdicao}')
                 
-                st.toast("Submissão feita com sucesso", icon=":material/thumb_up:")
+                st.toast("Submissão registrada, enviando para a planilha", icon=":material/thumb_up:")
 
 if pagina == "Falta":
 
@@ -1566,13 +2766,14 @@ if pagina == "Falta":
     
     st.subheader("Lançamento de Falta.")
     qf = st.sidebar.radio("Escolha:", ["Lançar Falta", "Editar Informações"])
+    mostrar_fila("Falta")
 
     if qf == "Lançar Falta":
         setorInfo = st.selectbox("Informe o setor do funcionário:", dados_Quadro_completo["SETOR"].unique())
 
         with st.form("Lançamento Falta"):
             faltadata = st.date_input("Dia da falta", format="DD/MM/YYYY")
-            nomeInfo = st.selectbox("Selecione o nome:", dados_Quadro_completo[dados_Quadro_completo["SETOR"] == setorInfo])
+            nomeInfo = st.selectbox("Selecione o nome:", opcoes_por_chave(dados_Quadro_completo, ["SETOR"], "NOME", setorInfo))
             turno = st.selectbox("Informe o turno:", ["Matutino", "Vespertino", "Dia inteiro"])
             atestado = st.selectbox("Apresentou justificaiva (abonar falta)?", ["Sim", "Não"])
             observacao = st.text_input("Observações:", max_chars=50)
@@ -1593,38 +2794,22 @@ if pagina == "Falta":
 
                 st.toast(f"{valores_linha}")
 
-                if dados_Falta_completo is not None and len(dados_Falta_completo) > 0:
-                    ultima_linha = dados_Falta_completo.index[-1] + 3
-                else:
-                    ultima_linha = 2  # primeira linha de dados
-            
-                planilhaFalta.batch_update([{
-                            'range': f'A{ultima_linha}:E{ultima_linha}',
-                            'values': [valores_linha]
-                        }])
+                enfileirar_escrita("Falta", valores_linha)
                 
-                st.toast("Submissão feita com sucesso", icon=":material/thumb_up:")
+                st.toast("Submissão registrada, enviando para a planilha", icon=":material/thumb_up:")
 
     elif qf == "Editar Informações":
 
-        dados_periodo = dados_Falta_completo.copy()
-        dados_periodo['DATA_DT'] = pd.to_datetime(dados_periodo['DATA'], format='%d/%m/%Y')
-        dados_periodo['MES'] = dados_periodo['DATA_DT'].dt.month
-        dados_periodo['ANO'] = dados_periodo['DATA_DT'].dt.year
-        meses_anos = dados_periodo.groupby(['MES', 'ANO']).size().reset_index()
-        meses_anos['MES_ANO'] = meses_anos['MES'].astype(str) + '/' + meses_anos['ANO'].astype(str)
-        dados_periodo['MES_ANO'] = dados_periodo['MES'].astype(str) + '/' + dados_periodo['ANO'].astype(str)
-        meses_anos = meses_anos.sort_values(['ANO', 'MES'], ascending=[False, False])
-
-        meses = meses_anos['MES_ANO'].unique().tolist()
+        dados_periodo = dados_com_datas(dados_Falta_completo)
+        meses = meses_disponiveis(dados_Falta_completo)
         
         periodo_selecionado = st.selectbox("Informe o mês da ausência registrada desse funcionário:", meses)
                 
-        dataInfo = st.selectbox("Qual a data que deseja editar?", dados_periodo[dados_periodo["MES_ANO"] == periodo_selecionado])
-        nomeInfo = st.selectbox("Selecione o nome:", dados_Falta_completo[dados_Falta_completo["DATA"] == dataInfo]["NOME"].unique())
+        dataInfo = st.selectbox("Qual a data que deseja editar?", opcoes_por_chave(dados_periodo, ["PERIODO"], "DATA", periodo_de_texto(periodo_selecionado)))
+        nomeInfo = st.selectbox("Selecione o nome:", opcoes_por_chave(dados_Falta_completo, ["DATA"], "NOME", dataInfo))
 
-        indiceEdicao = dados_Falta_completo.index[(dados_Falta_completo['DATA'] == dataInfo) & (dados_Falta_completo['NOME'] == nomeInfo)].tolist()
-        linhaEdicao = indiceEdicao[0] + 2
+        indiceEdicao = linha_para_editar(dados_Falta_completo, ["DATA", "NOME"], dataInfo, nomeInfo)
+        linhaEdicao = indiceEdicao + 2
 
         nomes_disponiveis = dados_Quadro_completo["NOME"].unique()
         try:
@@ -1657,9 +2842,6 @@ if pagina == "Falta":
 
                 st.toast(f"{valores_linha}")
             
-                planilhaFalta.batch_update([{
-                            'range': f'A{linhaEdicao}:E{linhaEdicao}',
-                            'values': [valores_linha]
-                        }])
+                enfileirar_escrita("Falta", valores_linha, intervalo=f'A{linhaEdicao}:E{linhaEdicao}')
                 
-                st.toast("Submissão feita com sucesso", icon=":material/thumb_up:")
+                st.toast("Submissão registrada, enviando para a planilha", icon=":material/thumb_up:")